@@ -4,8 +4,16 @@ Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses
 """
 
 import importlib
+import random
+from functools import partial
+import numpy as np
 import torch.utils.data
+from data.autotune import autotune_loader, worker_options
 from data.base_dataset import BaseDataset
+from data.batch_augment import AugmentedLoader, BatchAugment
+from data.sample_index import class_histogram, instance_count, sample_index, sample_size
+from data.samplers import (InstanceBucketBatchSampler, ResumableSampler, SizeBucketBatchSampler, bucket_sizes,
+                           class_balanced_weights)
 
 
 def find_dataset_using_name(dataset_name):
@@ -38,17 +46,103 @@ def get_option_setter(dataset_name):
     return dataset_class.modify_commandline_options
 
 
+# The sampler or batch sampler of the training DataLoader, None for the
+# default uniform shuffle
+def create_sampler(opt, dataset):
+    if opt.batch_sampler == 'instance_bucket':
+        assert opt.sampler == 'random', '--batch_sampler instance_bucket can not be used with --sampler %s' % opt.sampler
+        assert not opt.no_instance, '--batch_sampler instance_bucket needs the instance maps'
+        counts = sample_index(dataset, 'instances', instance_count)
+        print('instances per sample: median %d, max %d' % (np.median(counts), counts.max()))
+        batch_sampler = InstanceBucketBatchSampler(counts, opt.batchSize, drop_last=opt.isTrain,
+                                                   shuffle=not opt.serial_batches,
+                                                   bucket_batches=opt.bucket_batches)
+        return None, batch_sampler
+
+    if opt.batch_sampler == 'size_bucket':
+        assert opt.sampler == 'random', '--batch_sampler size_bucket can not be used with --sampler %s' % opt.sampler
+        assert opt.preprocess_mode == 'none' and not opt.batch_augment, \
+            '--batch_sampler size_bucket keeps the size of the samples, it needs --preprocess_mode none'
+        # the generator upsamples its latent map 2 ** num_up_layers times
+        num_up_layers = {'normal': 5, 'more': 6, 'most': 7}[getattr(opt, 'num_upsampling_layers', 'normal')]
+        assert opt.bucket_step % 2 ** num_up_layers == 0, \
+            '--bucket_step must be a multiple of %d' % 2 ** num_up_layers
+        dataset.bucket_sizes = bucket_sizes(sample_index(dataset, 'sizes', sample_size), opt.bucket_step)
+        batch_sampler = SizeBucketBatchSampler(dataset.bucket_sizes, opt.batchSize, drop_last=opt.isTrain,
+                                               shuffle=opt.isTrain and not opt.serial_batches)
+        print('%d sizes of samples, %d batches' %
+              (len(np.unique(dataset.bucket_sizes, axis=0)), len(batch_sampler)))
+        return None, batch_sampler
+
+    if opt.sampler == 'class_balanced':
+        num_classes = opt.label_nc + 1
+        histograms = sample_index(dataset, 'classes', partial(class_histogram, num_classes=num_classes),
+                                  options={'num_classes': num_classes})
+        weights = class_balanced_weights(histograms, opt.class_balance_power)
+        print('class balanced sampling: sample weights from %.2f to %.2f' % (weights.min(), weights.max()))
+        sampler = torch.utils.data.WeightedRandomSampler(torch.from_numpy(weights), len(dataset))
+        return sampler, None
+
+    if opt.sampler == 'resumable':
+        return ResumableSampler(len(dataset), opt.sampler_seed, shuffle=not opt.serial_batches), None
+
+    return None, None
+
+
+def dataset_loader_options(opt, dataset):
+    # the size buckets are also needed to batch the test samples
+    if opt.isTrain or opt.batch_sampler == 'size_bucket':
+        sampler, batch_sampler = create_sampler(opt, dataset)
+    else:
+        sampler, batch_sampler = None, None
+    if batch_sampler is not None:
+        return {'batch_sampler': batch_sampler}
+    return {'batch_size': opt.batchSize,
+            'shuffle': sampler is None and not opt.serial_batches,
+            'sampler': sampler,
+            'drop_last': opt.isTrain}
+
+
+# torch seeds every worker with its own seed, random and numpy are seeded
+# from it so that the workers draw different augmentations
+def seed_worker(worker_id):
+    seed = torch.initial_seed() % 2 ** 32
+    random.seed(seed)
+    np.random.seed(seed)
+
+
 def create_dataloader(opt):
     dataset = find_dataset_using_name(opt.dataset_mode)
     instance = dataset()
     instance.initialize(opt)
     print("dataset [%s] of size %d was created" %
           (type(instance).__name__, len(instance)))
-    dataloader = torch.utils.data.DataLoader(
-        instance,
-        batch_size=opt.batchSize,
-        shuffle=not opt.serial_batches,
-        num_workers=int(opt.nThreads),
-        drop_last=opt.isTrain
-    )
+
+    if isinstance(instance, torch.utils.data.IterableDataset):
+        # the dataset shuffles and splits the samples itself
+        assert opt.sampler == 'random' and opt.batch_sampler == 'none', \
+            'dataset [%s] can not be used with --sampler or --batch_sampler' % type(instance).__name__
+        loader_options = {'batch_size': opt.batchSize,
+                          'shuffle': False,
+                          'drop_last': opt.isTrain}
+    else:
+        loader_options = dataset_loader_options(opt, instance)
+    loader_options.update({'pin_memory': opt.pin_memory,
+                           'worker_init_fn': seed_worker})
+    if opt.loader_seed >= 0:
+        generator = torch.Generator()
+        generator.manual_seed(opt.loader_seed)
+        loader_options['generator'] = generator
+
+    if opt.autotune_loader:
+        # the next dataloaders (e.g. with --train_eval) use the same settings
+        opt.nThreads, prefetch_factor = autotune_loader(instance, loader_options, opt.autotune_batches)
+        if prefetch_factor is not None:
+            opt.prefetch_factor = prefetch_factor
+        opt.autotune_loader = False
+
+    loader_options = worker_options(loader_options, int(opt.nThreads), opt.prefetch_factor, opt.persistent_workers)
+    dataloader = torch.utils.data.DataLoader(instance, **loader_options)
+    if opt.batch_augment:
+        dataloader = AugmentedLoader(dataloader, BatchAugment(opt), use_cuda=len(opt.gpu_ids) > 0)
     return dataloader
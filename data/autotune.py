@@ -0,0 +1,69 @@
+import os
+import time
+import torch.utils.data
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# 0, 1, 2, 4, ... up to the number of cores this process may run on
+def worker_counts(max_workers):
+    counts = [0]
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return sorted(set(counts))
+
+
+# the DataLoader arguments that only exist with worker processes
+def worker_options(loader_options, num_workers, prefetch_factor, persistent_workers):
+    options = dict(loader_options, num_workers=num_workers)
+    if num_workers > 0:
+        options['prefetch_factor'] = prefetch_factor
+        options['persistent_workers'] = persistent_workers
+    return options
+
+
+# samples/s of a DataLoader after its first batch, which includes starting the workers
+def measure_loader(dataset, loader_options, num_batches):
+    loader = torch.utils.data.DataLoader(dataset, **loader_options)
+    iterator = iter(loader)
+    try:
+        next(iterator)
+    except StopIteration:
+        return 0.0
+    samples = 0
+    start = time.time()
+    for _ in range(num_batches):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            break
+        samples += len(batch['label'])
+    elapsed = time.time() - start
+    # shuts the workers down
+    del iterator
+    return samples / max(elapsed, 1e-6)
+
+
+# Measures a few batches with every number of workers and prefetch depth
+# (--autotune_loader) and returns the fastest (num_workers, prefetch_factor)
+def autotune_loader(dataset, loader_options, num_batches, prefetch_factors=(2, 4, 8)):
+    results = []
+    for num_workers in worker_counts(available_cpus()):
+        for prefetch_factor in (prefetch_factors if num_workers > 0 else [None]):
+            options = worker_options(loader_options, num_workers, prefetch_factor, False)
+            speed = measure_loader(dataset, options, num_batches)
+            print('loader with %d workers, prefetch factor %s: %.1f samples/s' %
+                  (num_workers, prefetch_factor, speed))
+            results.append((speed, num_workers, prefetch_factor))
+    speed, num_workers, prefetch_factor = max(results, key=lambda r: r[0])
+    print('using %d loader workers with prefetch factor %s (%.1f samples/s)' %
+          (num_workers, prefetch_factor, speed))
+    return num_workers, prefetch_factor
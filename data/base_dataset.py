@@ -9,6 +9,7 @@ import torchvision.transforms as transforms
 import numpy as np
 import random
 import torch
+from data.packing import to_pil
 
 class BaseDataset(data.Dataset):
     def __init__(self):
@@ -30,7 +31,11 @@ def repair_data(data,batchsize):
             data[key] += data[key][:repair_num]
     return data
 
-def get_params(opt, size):
+# fg_box is the (x0, y0, x1, y1) box of the foreground of the sample, in
+# fractions of its width and height (see data/sample_index.py). With a
+# probability of opt.fg_crop_prob, the crop is placed over it.
+# resize is the (h, w) of the sample with --batch_sampler size_bucket.
+def get_params(opt, size, fg_box=None, resize=None):
     w, h = size
     new_h = h
     new_w = w
@@ -45,11 +50,17 @@ def get_params(opt, size):
         ls = int(opt.load_size * ls / ss)
         new_w, new_h = (ss, ls) if width_is_shorter else (ls, ss)
 
-    x = random.randint(0, np.maximum(0, new_w - opt.crop_size))
-    y = random.randint(0, np.maximum(0, new_h - opt.crop_size))
+    max_x = np.maximum(0, new_w - opt.crop_size)
+    max_y = np.maximum(0, new_h - opt.crop_size)
+    if fg_box is not None and fg_box[2] > fg_box[0] and random.random() < opt.fg_crop_prob:
+        x = __fg_crop_start(fg_box[0] * new_w, fg_box[2] * new_w, opt.crop_size, max_x)
+        y = __fg_crop_start(fg_box[1] * new_h, fg_box[3] * new_h, opt.crop_size, max_y)
+    else:
+        x = random.randint(0, max_x)
+        y = random.randint(0, max_y)
 
     flip = random.random() > 0.5
-    return {'crop_pos': (x, y), 'flip': flip}
+    return {'crop_pos': (x, y), 'flip': flip, 'resize': resize}
 
 
 def get_transform(opt, params, method=Image.BICUBIC, normalize=True, toTensor=True):
@@ -65,7 +76,10 @@ def get_transform(opt, params, method=Image.BICUBIC, normalize=True, toTensor=Tr
     if 'crop' in opt.preprocess_mode:
         transform_list.append(transforms.Lambda(lambda img: __crop(img, params['crop_pos'], opt.crop_size)))
 
-    if opt.preprocess_mode == 'none':
+    if opt.preprocess_mode == 'none' and params.get('resize') is not None:
+        h, w = params['resize']
+        transform_list.append(transforms.Lambda(lambda img: __resize(img, int(w), int(h), method)))
+    elif opt.preprocess_mode == 'none':
         base = 32
         transform_list.append(transforms.Lambda(lambda img: __make_power_2(img, base, method)))
 
@@ -77,7 +91,12 @@ def get_transform(opt, params, method=Image.BICUBIC, normalize=True, toTensor=Tr
     if opt.isTrain and not opt.no_flip:
         transform_list.append(transforms.Lambda(lambda img: __flip(img, params['flip'])))
 
-    if toTensor:
+    if toTensor and opt.uint8_pipeline:
+        # the conversion to float and the normalization are done on the
+        # device, see Pix2PixModel.preprocess_input
+        transform_list += [transforms.Lambda(to_uint8_tensor)]
+        normalize = False
+    elif toTensor:
         transform_list += [transforms.ToTensor()]
 
     if normalize:
@@ -86,6 +105,145 @@ def get_transform(opt, params, method=Image.BICUBIC, normalize=True, toTensor=Tr
     return transforms.Compose(transform_list)
 
 
+# like transforms.ToTensor, but keeps the integer values and dtype of the image
+def to_uint8_tensor(img):
+    return array_to_tensor(np.array(img))
+
+
+# HxW or HxWxC array to a CxHxW tensor with the same dtype
+def array_to_tensor(array):
+    if array.ndim == 2:
+        array = array[None]
+    else:
+        array = array.transpose(2, 0, 1)
+    return torch.from_numpy(np.ascontiguousarray(array))
+
+
+class JointTransform():
+    """ The resize/crop/flip of get_transform applied to all the planes of a
+        sample at once, on numpy arrays. Label-like planes (label, instance,
+        sketch) are resampled with nearest interpolation: resize, crop and
+        flip reduce to one gather with the same row/column indices for every
+        plane, so only the output pixels are read from the source arrays.
+        The image is resized with bicubic interpolation and cropped/flipped
+        with the same indices. The plan is built once per preprocess_mode.
+    """
+
+    def __init__(self, opt):
+        self.opt = opt
+        mode = opt.preprocess_mode
+        self.crop = 'crop' in mode
+        self.flip = opt.isTrain and not opt.no_flip
+        if 'resize' in mode:
+            self.resized_size = self.resize_size
+        elif 'scale_width' in mode:
+            self.resized_size = self.scale_width_size
+        elif 'scale_shortside' in mode:
+            self.resized_size = self.scale_shortside_size
+        elif mode == 'none':
+            self.resized_size = self.power_2_size
+        elif mode == 'fixed':
+            self.resized_size = self.fixed_size
+        else:
+            self.resized_size = lambda w, h: (w, h)
+        # nearest source indices for each (size, resized size)
+        self.nearest_cache = {}
+
+    def resize_size(self, w, h):
+        return self.opt.load_size, self.opt.load_size
+
+    def scale_width_size(self, w, h):
+        if w == self.opt.load_size:
+            return w, h
+        return self.opt.load_size, int(self.opt.load_size * h / w)
+
+    def scale_shortside_size(self, w, h):
+        ss, ls = min(w, h), max(w, h)
+        if ss == self.opt.load_size:
+            return w, h
+        ls = int(self.opt.load_size * ls / ss)
+        return (ss, ls) if w == ss else (ls, ss)
+
+    def power_2_size(self, w, h, base=32):
+        return int(round(w / base) * base), int(round(h / base) * base)
+
+    def fixed_size(self, w, h):
+        return self.opt.crop_size, round(self.opt.crop_size / self.opt.aspect_ratio)
+
+    def nearest_index(self, size, new_size):
+        key = (size, new_size)
+        if key not in self.nearest_cache:
+            # same sampling as PIL's Image.NEAREST, including the
+            # accumulation of the step, so that the results are identical
+            step = size / new_size
+            position = step * 0.5
+            index = np.empty(new_size, dtype=np.int64)
+            for i in range(new_size):
+                index[i] = int(position)
+                position += step
+            self.nearest_cache[key] = np.minimum(index, size - 1)
+        return self.nearest_cache[key]
+
+    # the indices of the output pixels in the resized plane, and which of
+    # them fall inside it (PIL pads crops outside the image with zeros)
+    def window(self, start, length, new_size, flip):
+        index = np.arange(start, start + length)
+        if flip:
+            index = index[::-1]
+        valid = index < new_size
+        return np.minimum(index, new_size - 1), valid
+
+    def gather(self, array, rows, cols, valid_rows, valid_cols):
+        out = array[rows[:, None], cols[None, :]]
+        if not valid_rows.all():
+            out[~valid_rows] = 0
+        if not valid_cols.all():
+            out[:, ~valid_cols] = 0
+        return out
+
+    def __call__(self, planes, params):
+        label = planes['label']
+        h, w = np.shape(label)[:2]
+        if params.get('resize') is not None:
+            new_h, new_w = (int(v) for v in params['resize'])
+        else:
+            new_w, new_h = self.resized_size(w, h)
+        if self.crop:
+            x, y = params['crop_pos']
+            out_w = out_h = self.opt.crop_size
+        else:
+            x, y = 0, 0
+            out_w, out_h = new_w, new_h
+        flip = self.flip and params['flip']
+        rows, valid_rows = self.window(y, out_h, new_h, False)
+        cols, valid_cols = self.window(x, out_w, new_w, flip)
+
+        out = {}
+        src_rows = self.nearest_index(h, new_h)[rows]
+        src_cols = self.nearest_index(w, new_w)[cols]
+        for name in ['label', 'instance', 'sketch']:
+            plane = planes.get(name)
+            if plane is None:
+                out[name] = None
+            else:
+                # other planes only need a shape and fancy indexing,
+                # see data/fits_dataset.py
+                if isinstance(plane, Image.Image):
+                    plane = np.asarray(plane)
+                out[name] = self.gather(plane, src_rows, src_cols, valid_rows, valid_cols)
+
+        image = planes.get('image')
+        if image is None:
+            out['image'] = None
+        else:
+            if isinstance(image, Image.Image):
+                image = np.asarray(image)
+            if np.shape(image)[:2] != (new_h, new_w):
+                image = np.asarray(to_pil(image).resize((new_w, new_h), Image.BICUBIC))
+            out['image'] = self.gather(image, rows, cols, valid_rows, valid_cols)
+        return out
+
+
 def normalize():
     return transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
 
@@ -123,6 +281,15 @@ def __scale_shortside(img, target_width, method=Image.BICUBIC):
     return img.resize((nw, nh), method)
 
 
+# a random crop start such that the crop covers [lo, hi), or lies within it
+# if it is smaller
+def __fg_crop_start(lo, hi, crop_size, max_start):
+    first, last = sorted((hi - crop_size, lo))
+    first = int(np.clip(np.ceil(first), 0, max_start))
+    last = int(np.clip(np.floor(last), 0, max_start))
+    return random.randint(min(first, last), max(first, last))
+
+
 def __crop(img, pos, size):
     ow, oh = img.size
     x1, y1 = pos
@@ -0,0 +1,100 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from data.base_dataset import JointTransform, get_params
+
+
+class BatchAugment():
+    """ The random resize/crop/flip of get_transform, applied to a whole
+        collated batch of full size uint8 maps on the training device
+        (--batch_augment). The parameters of every sample are drawn with
+        get_params like in the data workers. Label-like maps are resampled
+        with the nearest indices of JointTransform in one gather for the
+        batch, the image with bicubic interpolation.
+    """
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.plan = JointTransform(opt)
+
+    def sample_windows(self, batch_size, w, h, new_w, new_h):
+        rows, cols, valid_rows, valid_cols = [], [], [], []
+        for _ in range(batch_size):
+            params = get_params(self.opt, (w, h))
+            if self.plan.crop:
+                x, y = params['crop_pos']
+                out_w = out_h = self.opt.crop_size
+            else:
+                x, y = 0, 0
+                out_w, out_h = new_w, new_h
+            flip = self.plan.flip and params['flip']
+            r, vr = self.plan.window(y, out_h, new_h, False)
+            c, vc = self.plan.window(x, out_w, new_w, flip)
+            rows.append(r)
+            cols.append(c)
+            valid_rows.append(vr)
+            valid_cols.append(vc)
+        valid = np.stack(valid_rows)[:, :, None] & np.stack(valid_cols)[:, None, :]
+        return np.stack(rows), np.stack(cols), valid
+
+    def gather(self, x, rows, cols, valid):
+        index = torch.arange(x.size(0), device=x.device)[:, None, None]
+        # advanced indices around a slice put the channels last
+        out = x[index, :, rows[:, :, None], cols[:, None, :]].permute(0, 3, 1, 2)
+        return out.masked_fill(~valid[:, None], 0).contiguous()
+
+    # returns a new dict, the tensors of data are left untouched
+    def __call__(self, data):
+        data = dict(data)
+        label = data['label']
+        b, _, h, w = label.size()
+        new_w, new_h = self.plan.resized_size(w, h)
+        rows, cols, valid = self.sample_windows(b, w, h, new_w, new_h)
+
+        device = label.device
+        valid = torch.from_numpy(valid).to(device)
+        src_rows = torch.from_numpy(self.plan.nearest_index(h, new_h)[rows]).to(device)
+        src_cols = torch.from_numpy(self.plan.nearest_index(w, new_w)[cols]).to(device)
+        for name in ['label', 'instance', 'sketch']:
+            if torch.is_tensor(data[name]) and data[name].dim() == 4:
+                data[name] = self.gather(data[name], src_rows, src_cols, valid)
+
+        image = data.get('image')
+        if torch.is_tensor(image) and image.dim() == 4:
+            if (image.size(3), image.size(2)) != (new_w, new_h):
+                image = F.interpolate(image.float(), size=(new_h, new_w), mode='bicubic', align_corners=False)
+                image = image.round_().clamp_(0, 255).to(torch.uint8)
+            rows = torch.from_numpy(rows).to(device)
+            cols = torch.from_numpy(cols).to(device)
+            data['image'] = self.gather(image, rows, cols, valid)
+        return data
+
+
+class AugmentedLoader():
+    """ Wraps a DataLoader so that every batch is moved to the GPU and
+        augmented by BatchAugment once, before the model is called: the
+        generator and discriminator steps then see the same crops.
+    """
+
+    def __init__(self, loader, augment, use_cuda=True):
+        self.loader = loader
+        self.augment = augment
+        self.use_cuda = use_cuda and torch.cuda.is_available()
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    def __iter__(self):
+        for batch in self.loader:
+            if self.use_cuda:
+                batch = {key: value.cuda(non_blocking=True) if torch.is_tensor(value) else value
+                         for key, value in batch.items()}
+            yield self.augment(batch)
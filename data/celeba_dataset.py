@@ -1,11 +1,7 @@
 from data.pix2pix_dataset import Pix2pixDataset
 from data.image_folder import make_dataset
 import os.path
-from PIL import Image
-import numpy as np
-import torch
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 
 class CelebADataset(Pix2pixDataset):
     @staticmethod
@@ -44,37 +40,7 @@ class CelebADataset(Pix2pixDataset):
 
         return label_paths, image_paths, instance_paths, sketch_paths
 
-def make_inst_data():
-    def mkdir_path(path):
-        if not os.path.exists(path):
-            os.mkdir(path)
-    def reid_instance(inst_tensor):
-        inst_tensor = inst_tensor.float()
-        ori_idx = torch.sort(torch.unique(inst_tensor))[0]
-        new_idx = torch.arange(0, ori_idx.size()[0])
-        out_inst_tensor = torch.zeros_like(inst_tensor)
-        for idx in range(ori_idx.size()[0]):
-            tmp = inst_tensor.clone()
-            tmp[tmp != ori_idx[idx]] = -1
-            tmp[tmp == ori_idx[idx]] = new_idx[idx]
-            tmp[tmp == -1] = 0
-            out_inst_tensor += tmp
-        return out_inst_tensor
-    def make_inst_subset(set='test'):
-        assert set == 'test' or set == 'train', "set is test or train"
-        print('process ', set)
-        root = '/home/tzt/HairSynthesis/SPADE/datasets/CelebA-HQ/'
-        src_root = os.path.join(root,set,'labels')
-        tag_root = os.path.join(root,set,'instances')
-        mkdir_path(tag_root)
-        names = sorted(os.listdir(src_root))
-        for id in tqdm(range(len(names))):
-            name = names[id]
-            src_mask = np.array(Image.open(os.path.join(src_root,name)))
-            tag_label_tensor = torch.from_numpy(src_mask)
-            tag_inst = reid_instance(tag_label_tensor).numpy()
-            tag_inst = Image.fromarray(np.uint8(tag_inst))
-            tag_inst.save(os.path.join(tag_root,name))
-
-    make_inst_subset('test')
-    make_inst_subset('train')
+def make_inst_data(num_workers=1):
+    # same as python make_instances.py --dataset celeba
+    from make_instances import make_inst_for_celeba
+    make_inst_for_celeba('/home/tzt/HairSynthesis/SPADE/datasets/CelebA-HQ/', num_workers)
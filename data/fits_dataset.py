@@ -0,0 +1,233 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from data.radiogalaxy_dataset import RadioGalaxyDataset
+try:
+    from astropy.io import fits
+    from astropy.visualization import (AsinhStretch, LinearStretch, LogStretch, ManualInterval,
+                                       PercentileInterval, SqrtStretch)
+    STRETCHES = {'linear': LinearStretch, 'sqrt': SqrtStretch, 'log': LogStretch, 'asinh': AsinhStretch}
+except ImportError:
+    fits = None
+    STRETCHES = {}
+
+FITS_EXTENSIONS = ('.fits', '.fit', '.fts')
+
+
+def is_fits_file(filename):
+    return filename.lower().endswith(FITS_EXTENSIONS)
+
+
+class LazyPlane():
+    """ A plane read on demand. Subclasses give its shape and read(rows, cols),
+        which returns the pixels of two slices. Indexing it with the row and
+        column indices of JointTransform only reads the section they cover.
+    """
+
+    def read(self, rows, cols):
+        raise NotImplementedError
+
+    def __getitem__(self, index):
+        rows, cols = index
+        r0, c0 = rows.min(), cols.min()
+        data = self.read(slice(r0, rows.max() + 1), slice(c0, cols.max() + 1))
+        return data[rows - r0, cols - c0]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read(slice(None), slice(None))
+        return data if dtype is None else data.astype(dtype)
+
+    def close(self):
+        pass
+
+
+class OpenPlanes():
+    """ The planes opened by a process, by key. Beyond max_open planes, the
+        least recently used one is closed, so that the file handles and
+        memory maps of a large dataset do not pile up in the workers. The
+        planes are not pickled, every worker opens its own.
+    """
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.planes = OrderedDict()
+
+    def __getstate__(self):
+        return {'max_open': self.max_open, 'planes': OrderedDict()}
+
+    # the plane of key, opened by open_plane() if needed
+    def get(self, key, open_plane):
+        if key in self.planes:
+            self.planes.move_to_end(key)
+            return self.planes[key]
+        plane = self.planes[key] = open_plane()
+        if len(self.planes) > self.max_open:
+            self.planes.popitem(last=False)[1].close()
+        return plane
+
+
+class FitsPlane(LazyPlane):
+    """ A 2D plane of a FITS file (the last two axes of an HDU, the others at
+        index 0), read through a memory map for uncompressed files. stretch
+        turns the pixels of an image into uint8 RGB; maps (label, instance)
+        are cast to dtype.
+    """
+
+    def __init__(self, path, hdu=0, stretch=None, dtype=np.uint8):
+        self.hdul = fits.open(path, memmap=True, lazy_load_hdus=True)
+        self.key = (path, hdu)
+        hdu = self.hdul[hdu]
+        self.section = hdu.section
+        self.lead = (0,) * (len(hdu.shape) - 2)
+        self.stretch = stretch
+        self.dtype = np.dtype(np.uint8) if stretch is not None else np.dtype(dtype)
+        h, w = hdu.shape[-2:]
+        self.shape = (h, w, 3) if stretch is not None else (h, w)
+        self.ndim = len(self.shape)
+        if stretch is not None:
+            self.limits = stretch.plane_limits(self)
+
+    def read_raw(self, rows, cols):
+        return self.section[self.lead + (rows, cols)]
+
+    def read(self, rows, cols):
+        data = self.read_raw(rows, cols)
+        if self.stretch is None:
+            return np.nan_to_num(data).astype(self.dtype)
+        return self.stretch(data, self.limits)
+
+    def close(self):
+        self.hdul.close()
+
+
+class FitsStretch():
+    """ Maps the pixels of a radio image to [0, 1] with a fixed interval
+        (--fits_vmin/--fits_vmax), or the percentile interval of the whole
+        plane (--fits_percentile), applies --fits_stretch and returns uint8
+        RGB. The percentile interval is computed once per file, on a regular
+        subsample of at most max_pixels pixels, so that all the crops of a
+        source are scaled alike.
+    """
+
+    def __init__(self, opt, max_pixels=2 ** 20):
+        if opt.fits_vmin is not None and opt.fits_vmax is not None:
+            self.fixed_limits = (opt.fits_vmin, opt.fits_vmax)
+        else:
+            self.fixed_limits = None
+        self.interval = PercentileInterval(opt.fits_percentile)
+        self.stretch = STRETCHES[opt.fits_stretch]()
+        self.max_pixels = max_pixels
+        # the (vmin, vmax) of every plane read by this process
+        self.limits = {}
+
+    def plane_limits(self, plane):
+        if self.fixed_limits is not None:
+            return self.fixed_limits
+        if plane.key not in self.limits:
+            h, w = plane.shape[:2]
+            step = max(1, int(np.ceil(np.sqrt(h * w / self.max_pixels))))
+            data = plane.read_raw(slice(None, None, step), slice(None, None, step))
+            self.limits[plane.key] = self.interval.get_limits(np.asarray(data, dtype=np.float32))
+        return self.limits[plane.key]
+
+    def __call__(self, data, limits):
+        data = ManualInterval(*limits)(data.astype(np.float32), clip=True)
+        data = self.stretch(np.nan_to_num(data), clip=True)
+        data = (data * 255 + 0.5).astype(np.uint8)
+        return np.repeat(data[..., None], 3, axis=2)
+
+
+class FitsDataset(RadioGalaxyDataset):
+    """ Radio galaxies read from the FITS files of the survey instead of 8-bit
+        PNG cutouts. Same layout as RadioGalaxyDataset, with the images in
+        [dataroot]/[phase]/images/*.fits and the masks and instances as FITS or
+        PNG files. With --joint_transform and --preprocess_mode crop (the
+        defaults here), the crop is read from the memory mapped HDUs, so only
+        its pixels are paged in. The other modes resize the whole plane.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser = RadioGalaxyDataset.modify_commandline_options(parser, is_train)
+        parser.add_argument('--fits_hdu', type=int, default=0, help='HDU of the FITS files holding the data')
+        parser.add_argument('--fits_stretch', type=str, default='linear', choices=('linear', 'sqrt', 'log', 'asinh'),
+                            help='stretch applied to the radio images after the interval')
+        parser.add_argument('--fits_percentile', type=float, default=99.5,
+                            help='percentile interval of the pixels of each image, used unless --fits_vmin and --fits_vmax are given')
+        parser.add_argument('--fits_vmin', type=float, default=None, help='fixed lower bound of the interval')
+        parser.add_argument('--fits_vmax', type=float, default=None, help='fixed upper bound of the interval')
+        parser.add_argument('--no_joint_transform', action='store_false', dest='joint_transform',
+                            help='if specified, use the PIL pipeline of the other datasets, which reads the whole planes')
+        parser.set_defaults(joint_transform=True)
+        parser.set_defaults(preprocess_mode='crop')
+        parser.set_defaults(load_size=256)
+        return parser
+
+    def initialize(self, opt):
+        assert fits is not None, '--dataset_mode fits needs astropy, please install it with pip install astropy'
+        self.stretch = FitsStretch(opt)
+        self.planes = OpenPlanes()
+        RadioGalaxyDataset.initialize(self, opt)
+
+    def get_paths(self, opt):
+        root = os.path.join(opt.dataroot, opt.phase)
+        image_paths = []
+        label_paths = []
+        instance_paths = []
+        sketch_paths = []
+        for dirpath, _, filenames in sorted(os.walk(root, followlinks=True)):
+            for filename in sorted(filenames):
+                p = os.path.join(dirpath, filename)
+                if 'images' in p and self.is_image_file(p):
+                    image_paths.append(p)
+                elif 'mask' in p and self.is_map_file(p):
+                    label_paths.append(p)
+                elif 'instances' in p and self.is_map_file(p):
+                    instance_paths.append(p)
+                elif 'edgesD' in p and p.endswith('.png') and opt.add_sketch:
+                    sketch_paths.append(p)
+
+        return label_paths, image_paths, instance_paths, sketch_paths
+
+    def is_image_file(self, path):
+        return is_fits_file(path)
+
+    def is_map_file(self, path):
+        return is_fits_file(path) or path.endswith('.png')
+
+    def open_plane(self, path, image=False, dtype=np.uint8):
+        stretch = self.stretch if image else None
+        return self.planes.get((path, image), lambda: FitsPlane(path, self.opt.fits_hdu, stretch=stretch, dtype=dtype))
+
+    def open_map(self, path, dtype):
+        if is_fits_file(path):
+            return self.open_plane(path, dtype=dtype)
+        return Image.open(path)
+
+    def read_files(self, index):
+        label_path = self.label_paths[index]
+
+        if self.has_images:
+            image_path = self.image_paths[index]
+            image = self.open_plane(image_path, image=True)
+        else:
+            image_path = label_path
+            image = None
+
+        if self.opt.no_instance:
+            instance = None
+        else:
+            instance = self.open_map(self.instance_paths[index], np.int32)
+
+        if not self.opt.add_sketch:
+            sketch = None
+        else:
+            sketch = Image.open(self.sketch_paths[index])
+
+        return {'label': self.open_map(label_path, np.uint8),
+                'image': image,
+                'instance': instance,
+                'sketch': sketch,
+                'path': image_path,
+                }
@@ -1,27 +1,45 @@
 from torchvision.datasets import CocoDetection
 from pathlib import Path
+import numpy as np
 import torch
 import torch.utils.data
 import json
+import os
 from pycocotools import mask as coco_mask
 from . import transforms as T
+from .sample_index import pool_map
 import torchvision.transforms.functional as F 
 
 class GalaxyDetection(CocoDetection):
-    def __init__(self, img_folder, ann_file, transforms, return_masks):
+    '''
+    With cache_file, the prepared targets (boxes, labels and bit-packed masks)
+    of all the images are computed once by num_workers processes and stored
+    in cache_file (see GalaxyTargetCache), and __getitem__ only reads the
+    image and applies the transforms
+    '''
+    def __init__(self, img_folder, ann_file, transforms, return_masks, cache_file=None, num_workers=0):
         super(GalaxyDetection, self).__init__(img_folder, ann_file)
+        self.ann_file = ann_file
         self._transforms = transforms
         self.prepare = ConvertGalaxyPolysToMask(return_masks)
+        self.cache = None
+        if cache_file is not None:
+            self.cache = GalaxyTargetCache.load_or_build(cache_file, self, num_workers)
 
     def __getitem__(self, idx):
-        img, target = super(GalaxyDetection, self).__getitem__(idx)
         image_id = self.ids[idx]
+        if self.cache is not None:
+            img = self._load_image(image_id)
+            target = self.cache.target(idx)
+        else:
+            img, target = super(GalaxyDetection, self).__getitem__(idx)
         try:
             img_path = Path(img.filename)
         except:
             img_path = None
-        target = {'image_id': image_id, 'annotations': target}
-        img, target = self.prepare(img, target)
+        if self.cache is None:
+            target = {'image_id': image_id, 'annotations': target}
+            img, target = self.prepare(img, target)
         if self._transforms is not None:
             img, target = self._transforms(img, target)
         target['path'] = img_path
@@ -58,13 +76,42 @@ def check_annotation_integrity(annotation_path):
         if len(ann['segmentation'][0]) == 4:
             print(ann['segmentation'][0])
 
+def foreground_boxes(annotation_path):
+    '''
+    Union of the boxes of every image of a COCO annotation file, as
+    (x0, y0, x1, y1) in fractions of the image size, keyed by file name
+    without extension (see Pix2pixDataset.pairing_key)
+    '''
+    with open(annotation_path) as j:
+        annotations = json.load(j)
+    images = {img['id']: img for img in annotations['images']}
+    boxes = {}
+    for ann in annotations['annotations']:
+        if ann.get('iscrowd', 0) != 0:
+            continue
+        img = images[ann['image_id']]
+        w, h = img['width'], img['height']
+        x, y, bw, bh = ann['bbox']
+        box = [max(x, 0) / w, max(y, 0) / h, min(x + bw, w) / w, min(y + bh, h) / h]
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        key = Path(img['file_name']).stem
+        if key in boxes:
+            old = boxes[key]
+            box = [min(old[0], box[0]), min(old[1], box[1]), max(old[2], box[2]), max(old[3], box[3])]
+        boxes[key] = box
+    return boxes
+
 class ConvertGalaxyPolysToMask(object):
     def __init__(self, return_masks=False):
         self.return_masks = return_masks
 
     def __call__(self, image, target):
         w, h = image.size
+        return image, self.prepare_target(target, w, h)
 
+    # the target of an image of w x h, from its COCO annotations
+    def prepare_target(self, target, w, h):
         image_id = target["image_id"]
         image_id = torch.tensor([image_id])
 
@@ -117,15 +164,97 @@ class ConvertGalaxyPolysToMask(object):
             target["keypoints"] = keypoints
 
         # for conversion to coco api
-        area = torch.tensor([obj["area"] for obj in anno])
-        iscrowd = torch.tensor([obj["iscrowd"] if "iscrowd" in obj else 0 for obj in anno])
+        # explicit dtypes, so that images without objects get the same ones
+        area = torch.tensor([obj["area"] for obj in anno], dtype=torch.float32)
+        iscrowd = torch.tensor([obj["iscrowd"] if "iscrowd" in obj else 0 for obj in anno], dtype=torch.int64)
         target["area"] = area[keep]
         target["iscrowd"] = iscrowd[keep]
 
         target["orig_size"] = torch.as_tensor([int(h), int(w)])
         target["size"] = torch.as_tensor([int(h), int(w)])
 
-        return image, target
+        return target
+
+
+def _prepare_one(state, image_id):
+    prepare, coco = state
+    info = coco.imgs[image_id]
+    anno = coco.loadAnns(coco.getAnnIds(image_id))
+    target = prepare.prepare_target({'image_id': image_id, 'annotations': anno},
+                                                     info['width'], info['height'])
+    if 'masks' in target:
+        masks = target['masks'].numpy().reshape(len(target['masks']), info['height'] * info['width'])
+        target['masks'] = np.packbits(masks, axis=1)
+    return {key: value.numpy() if torch.is_tensor(value) else value for key, value in target.items()}
+
+
+class GalaxyTargetCache(object):
+    '''
+    The prepared targets of a GalaxyDetection, in one .npz file. The per object
+    arrays of all the images are concatenated and split by offsets, and each
+    mask is stored bit-packed (np.packbits of its h x w pixels). The cache is
+    built again when the annotation file or return_masks change. Keypoints are
+    not cached.
+    '''
+    FIELDS = [('boxes', np.float32), ('labels', np.int64), ('area', np.float32), ('iscrowd', np.int64)]
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.offsets = arrays['offsets']
+
+    @staticmethod
+    def signature(dataset):
+        stat = os.stat(dataset.ann_file)
+        return json.dumps({'ann_file': os.path.abspath(dataset.ann_file), 'mtime': stat.st_mtime,
+                           'size': stat.st_size, 'return_masks': dataset.prepare.return_masks})
+
+    @classmethod
+    def load_or_build(cls, path, dataset, num_workers=0):
+        signature = cls.signature(dataset)
+        if os.path.isfile(path):
+            arrays = dict(np.load(path))
+            if str(arrays['signature']) == signature and np.array_equal(arrays['image_ids'], dataset.ids):
+                return cls(arrays)
+            print('the target cache at %s is out of date' % path)
+        cache = cls.build(dataset, num_workers)
+        cache.arrays['signature'] = np.array(signature)
+        np.savez(str(path) + '.tmp.npz', **cache.arrays)
+        os.replace(str(path) + '.tmp.npz', path)
+        print('wrote the targets of %d images at %s' % (len(dataset.ids), path))
+        return cache
+
+    @classmethod
+    def build(cls, dataset, num_workers=0):
+        targets = pool_map(_prepare_one, (dataset.prepare, dataset.coco), dataset.ids, num_workers,
+                           desc='preparing the targets')
+
+        counts = [len(t['labels']) for t in targets]
+        arrays = {'image_ids': np.array(dataset.ids, dtype=np.int64),
+                  'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                  'sizes': np.array([t['size'] for t in targets], dtype=np.int64).reshape(-1, 2)}
+        for name, dtype in cls.FIELDS:
+            arrays[name] = np.concatenate([np.asarray(t[name], dtype=dtype) for t in targets])
+        arrays['boxes'] = arrays['boxes'].reshape(-1, 4)
+        if dataset.prepare.return_masks:
+            masks = [t['masks'] for t in targets]
+            arrays['mask_offsets'] = np.concatenate([[0], np.cumsum([m.size for m in masks])]).astype(np.int64)
+            arrays['masks'] = np.concatenate([m.reshape(-1) for m in masks]).astype(np.uint8)
+        return cls(arrays)
+
+    # the target of the idx-th image, as returned by ConvertGalaxyPolysToMask
+    def target(self, idx):
+        a = self.arrays
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        h, w = (int(v) for v in a['sizes'][idx])
+        target = {name: torch.from_numpy(a[name][start:end].copy()) for name, _ in self.FIELDS}
+        if 'masks' in a:
+            packed = a['masks'][a['mask_offsets'][idx]:a['mask_offsets'][idx + 1]]
+            masks = np.unpackbits(packed.reshape(end - start, (h * w + 7) // 8), axis=1, count=h * w)
+            target['masks'] = torch.from_numpy(masks.reshape(-1, h, w))
+        target['image_id'] = torch.tensor([int(a['image_ids'][idx])])
+        target['orig_size'] = torch.as_tensor([h, w])
+        target['size'] = torch.as_tensor([h, w])
+        return target
 
 def inv_normalize(tensor, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]):
     # return T.Normalize(
@@ -172,7 +301,7 @@ def make_galaxy_transforms(image_set):
     raise ValueError(f'unknown {image_set}')
 
 
-def build(image_set, data_path: str, masks: bool):
+def build(image_set, data_path: str, masks: bool, cache: bool = False, num_workers: int = 0):
     root = Path(data_path)
     assert root.exists(), f'provided data path {root} does not exist'
     PATHS = {
@@ -182,5 +311,8 @@ def build(image_set, data_path: str, masks: bool):
     }
 
     img_folder, ann_file = PATHS[image_set]
-    dataset = GalaxyDetection(img_folder, ann_file, transforms=make_galaxy_transforms(image_set), return_masks=masks)
+    # the prepared targets are cached next to the annotations, e.g. annotations/train.targets.npz
+    cache_file = ann_file.with_suffix('.targets.npz') if cache else None
+    dataset = GalaxyDetection(img_folder, ann_file, transforms=make_galaxy_transforms(image_set), return_masks=masks,
+                              cache_file=cache_file, num_workers=num_workers)
     return dataset
\ No newline at end of file
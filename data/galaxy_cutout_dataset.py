@@ -0,0 +1,116 @@
+import os
+from pathlib import Path
+import numpy as np
+import torch
+from data.galaxy import GalaxyDetection
+from data.pix2pix_dataset import Pix2pixDataset
+from data.utils import boxes_to_squares
+
+
+# the box of array, zero padded where it goes out of it
+def crop_array(array, box):
+    x0, y0, x1, y1 = box
+    out = np.zeros((y1 - y0, x1 - x0) + array.shape[2:], dtype=array.dtype)
+    h, w = array.shape[:2]
+    sx0, sy0, sx1, sy1 = max(x0, 0), max(y0, 0), min(x1, w), min(y1, h)
+    if sx1 > sx0 and sy1 > sy0:
+        out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = array[sy0:sy1, sx0:sx1]
+    return out
+
+
+class GalaxyCutoutDataset(Pix2pixDataset):
+    """ One sample per annotated source of a COCO radio galaxy dataset (see
+        data/galaxy.py): the square around its box, padded by --cutout_padding
+        pixels, with the label map of the classes of the sources in it and the
+        instance map of the sources, the centred one being instance 1. The
+        images are in [dataroot]/[phase] and the annotations in
+        [dataroot]/annotations/[phase].json. The squares of all the sources
+        are computed at once from the cached targets of GalaxyDetection, and
+        the cutouts are resized to crop_size by --preprocess_mode fixed.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser = Pix2pixDataset.modify_commandline_options(parser, is_train)
+        parser.add_argument('--cutout_padding', type=int, default=2, help='# pixels around the box of a source')
+        parser.add_argument('--min_source_size', type=int, default=1, help='sources with a smaller box side are skipped')
+        parser.set_defaults(preprocess_mode='fixed')
+        parser.set_defaults(load_size=128)
+        parser.set_defaults(crop_size=128)
+        parser.set_defaults(display_winsize=128)
+        parser.set_defaults(label_nc=4)
+        parser.set_defaults(contain_dontcare_label=True)
+        return parser
+
+    # there are no sketch maps, and the cutouts are read from the cached targets
+    unsupported_options = ('add_sketch', 'resize_cache')
+
+    def initialize(self, opt):
+        self.initialize_options(opt)
+        self.label_paths, self.image_paths, self.instance_paths, self.sketch_paths = [], [], [], []
+
+        root = Path(opt.dataroot)
+        self.ann_file = root / 'annotations' / ('%s.json' % opt.phase)
+        self.detection = GalaxyDetection(root / opt.phase, self.ann_file, transforms=None, return_masks=True,
+                                         cache_file=self.ann_file.with_suffix('.targets.npz'),
+                                         num_workers=int(opt.nThreads))
+        self.sources = self.source_table(opt)[:opt.max_dataset_size]
+        self.dataset_size = len(self.sources)
+        print('%d sources in %d images' % (self.dataset_size, len(self.detection)))
+
+        self.initialize_samples(opt)
+
+    # (image, source, x0, y0, x1, y1) of the square cutout of every source
+    def source_table(self, opt):
+        arrays = self.detection.cache.arrays
+        counts = np.diff(arrays['offsets'])
+        images = torch.from_numpy(np.repeat(np.arange(len(counts)), counts))
+        sources = torch.from_numpy(np.concatenate([np.arange(n) for n in counts] + [np.zeros(0, dtype=np.int64)]))
+        sizes = torch.from_numpy(arrays['sizes'])[images]
+        h, w = sizes[:, 0], sizes[:, 1]
+        # the cached boxes are already in pixels
+        boxes = torch.from_numpy(arrays['boxes']).round().long()
+        keep = ((boxes[:, 2:] - boxes[:, :2]) >= opt.min_source_size).all(1)
+        squares = boxes_to_squares(boxes, w, h, padding=opt.cutout_padding)
+        table = torch.cat([images[:, None], sources[:, None], squares], 1)
+        return table[keep].numpy()
+
+    def manifest_options(self, opt):
+        options = Pix2pixDataset.manifest_options(self, opt)
+        options.update({'cutout_padding': opt.cutout_padding, 'min_source_size': opt.min_source_size,
+                        'max_dataset_size': opt.max_dataset_size})
+        return options
+
+    def index_sources(self):
+        return [str(self.ann_file)]
+
+    def sample_keys(self):
+        return [self.source_key(i) for i in range(self.dataset_size)]
+
+    def source_key(self, index):
+        image, source = self.sources[index][:2]
+        info = self.detection.coco.imgs[self.detection.ids[image]]
+        return '%s_%d' % (os.path.splitext(os.path.basename(info['file_name']))[0], source)
+
+    def read_files(self, index):
+        image, source, x0, y0, x1, y1 = (int(v) for v in self.sources[index])
+        box = (x0, y0, x1, y1)
+        target = self.detection.cache.target(image)
+
+        masks = target['masks'].numpy().astype(bool)
+        label = np.zeros(masks.shape[1:], dtype=np.uint8)
+        instance = np.zeros(masks.shape[1:], dtype=np.uint8 if len(masks) < 256 else np.int32)
+        # the other sources first, so that the centred one is on top
+        order = [i for i in range(len(masks)) if i != source] + [source]
+        for k, i in enumerate(order):
+            label[masks[i]] = target['labels'][i]
+            instance[masks[i]] = len(order) - k
+
+        path = self.detection.coco.imgs[self.detection.ids[image]]['file_name']
+        stem, ext = os.path.splitext(os.path.join(str(self.detection.root), path))
+        return {'label': crop_array(label, box),
+                'image': self.detection._load_image(self.detection.ids[image]).crop(box) if self.has_images else None,
+                'instance': None if self.opt.no_instance else crop_array(instance, box),
+                'sketch': None,
+                'path': '%s_%d%s' % (stem, source, ext),
+                }
@@ -11,6 +11,8 @@ Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses
 ###############################################################################
 import torch.utils.data as data
 from PIL import Image
+import hashlib
+import json
 import os
 
 IMG_EXTENSIONS = [
@@ -64,6 +66,78 @@ def make_dataset(dir, recursive=False, read_cache=False, write_cache=False):
     return images
 
 
+def index_root(opt):
+    # where the manifests and the other per-dataset indices are stored
+    return opt.index_dir if opt.index_dir else os.path.join(opt.dataroot, '.index')
+
+
+def directory_mtimes(paths):
+    # the directories holding the files and all their parents up to the
+    # common root. Adding or removing a file changes the mtime of its directory.
+    dirs = set(os.path.dirname(p) for p in paths)
+    if len(dirs) == 0:
+        return {}
+    root = os.path.commonpath(list(dirs))
+    for d in list(dirs):
+        while d != root and len(d) > len(root):
+            d = os.path.dirname(d)
+            dirs.add(d)
+    return {d: os.stat(d).st_mtime_ns for d in sorted(dirs)}
+
+
+def options_digest(options):
+    return hashlib.md5(json.dumps(options, sort_keys=True).encode()).hexdigest()[:8]
+
+
+def manifest_file(opt, options):
+    return os.path.join(index_root(opt), 'manifest_%s_%s_%s.json' % (opt.dataset_mode, opt.phase, options_digest(options)))
+
+
+# Reads the JSON index at path written by save_index_json. Returns None if
+# it is missing or out of date: written with other options, or one of the
+# directories of its files changed since.
+def load_index_json(path, options):
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        index = json.load(f)
+    if index['options'] != options:
+        return None
+    for d, mtime in index['mtimes'].items():
+        try:
+            if os.stat(d).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    return index
+
+
+# Writes content to the JSON index at path, along with the options and the
+# mtimes of the directories of paths that load_index_json checks.
+# what names the index in the messages.
+def save_index_json(path, options, paths, content, what):
+    try:
+        # create the index directory first, it may live inside the dataset
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index = dict(content, options=options, mtimes=directory_mtimes(paths))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+        print('wrote %s at %s' % (what, path))
+    except OSError as e:
+        print('could not write %s at %s: %s' % (what, path, e))
+
+
+def load_manifest(path, options):
+    manifest = load_index_json(path, options)
+    return None if manifest is None else manifest['paths']
+
+
+def save_manifest(path, options, paths):
+    all_paths = [p for column in paths.values() for p in column]
+    save_index_json(path, options, all_paths, {'paths': paths}, 'file manifest')
+
+
 def default_loader(path):
     return Image.open(path).convert('RGB')
 
@@ -1,11 +1,11 @@
 from data.pix2pix_dataset import Pix2pixDataset
 from data.image_folder import make_dataset
 from pathlib import Path
-from data.base_dataset import get_params, get_transform
-from PIL import Image
 import torch
 
 class MaskDataset(Pix2pixDataset):
+    # only the masks are needed, the image is never read
+    has_images = False
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -47,44 +47,25 @@ class MaskDataset(Pix2pixDataset):
 
         return label_paths, image_paths, instance_paths, sketch_paths
 
-    def __getitem__(self, index):
-        # Label Image
-        label_path = self.label_paths[index]
-        label = Image.open(label_path)
-        params = get_params(self.opt, label.size)
-        transform_label = get_transform(self.opt, params, method=Image.NEAREST, normalize=False)
-        label_tensor = transform_label(label) * 255.0
+    def process_sample(self, sample):
+        label_tensor, _, instance_tensor, sketch_tensor = self.transform_sample(sample)
         # label_tensor[label_tensor == 255] = self.opt.label_nc  # 'unknown' is opt.label_nc
-        label_tensor = torch.where(label_tensor != 0, self.opt.label_nc, 0.)
-
-        # if using instance maps
-        if self.opt.no_instance:
-            instance_tensor = 0
-        else:
-            instance_path = self.instance_paths[index]
-            instance = Image.open(instance_path)
-            if instance.mode == 'L':
-                instance_tensor = transform_label(instance) * 255
-                instance_tensor = instance_tensor.long()
-            else:
-                instance_tensor = transform_label(instance)
-
-        # if using sketch maps
-        if not self.opt.add_sketch:
-            sketch_tensor = 0
-        else:
-            # sketch range is 0 and 255
-            sketch_path = self.sketch_paths[index]
-            sketch = Image.open(sketch_path)
-            sketch_tensor = transform_label(sketch)
+        label_tensor = torch.zeros_like(label_tensor).masked_fill_(label_tensor != 0, self.opt.label_nc)
 
         input_dict = {'label': label_tensor,
                       'instance': instance_tensor,
-                      'image': torch.rand(3, *label_tensor.shape[1:]), # HACK to avoid breaking everything, I don't need the image
                       'sketch': sketch_tensor,
-                      'path': label_path,
+                      'path': sample['path'],
                       }
 
+        # HACK to avoid breaking everything, I don't need the image.
+        # With --layout_only the model does not need it either.
+        if not self.opt.layout_only:
+            if self.opt.uint8_pipeline:
+                input_dict['image'] = torch.randint(0, 256, (3, *label_tensor.shape[1:]), dtype=torch.uint8)
+            else:
+                input_dict['image'] = torch.rand(3, *label_tensor.shape[1:])
+
         # Give subclasses a chance to modify the final output
         self.postprocess(input_dict)
 
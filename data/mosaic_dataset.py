@@ -0,0 +1,191 @@
+import os
+import random
+import numpy as np
+from data.fits_dataset import FitsDataset, FitsPlane, FitsStretch, LazyPlane, OpenPlanes, fits, is_fits_file
+
+
+class ArrayPlane(LazyPlane):
+    """ A 2D plane stored as a .npy file, read through np.load's memory map.
+        An image is either uint8 (gray or RGB) or of any other type, mapped
+        to uint8 RGB by stretch; maps (label, instance) are cast to dtype.
+    """
+
+    def __init__(self, path, image=False, stretch=None, dtype=np.uint8):
+        self.array = np.load(path, mmap_mode='r')
+        self.key = path
+        self.image = image
+        self.stretch = stretch
+        self.dtype = np.dtype(np.uint8) if image else np.dtype(dtype)
+        h, w = self.array.shape[:2]
+        self.shape = (h, w, 3) if image else (h, w)
+        self.ndim = len(self.shape)
+        assert not image or self.array.dtype == np.uint8 or stretch is not None, \
+            '%s is not uint8 and needs astropy to be stretched, please install it with pip install astropy' % path
+        if image and self.array.dtype != np.uint8:
+            self.limits = stretch.plane_limits(self)
+
+    def read_raw(self, rows, cols):
+        return self.array[rows, cols]
+
+    def read(self, rows, cols):
+        data = self.read_raw(rows, cols)
+        if not self.image:
+            return np.nan_to_num(data).astype(self.dtype)
+        if data.dtype != np.uint8:
+            return self.stretch(data, self.limits)
+        if data.ndim == 2:
+            return np.repeat(data[..., None], 3, axis=2)
+        return np.array(data)
+
+
+class Window(LazyPlane):
+    """ The h x w window of a plane starting at row y and column x. """
+
+    def __init__(self, plane, y, x, h, w):
+        self.plane = plane
+        self.y, self.x = y, x
+        self.dtype = plane.dtype
+        self.shape = (h, w) + plane.shape[2:]
+        self.ndim = len(self.shape)
+
+    def read(self, rows, cols):
+        r0, r1, _ = rows.indices(self.shape[0])
+        c0, c1, _ = cols.indices(self.shape[1])
+        return self.plane.read(slice(self.y + r0, self.y + r1), slice(self.x + c0, self.x + c1))
+
+
+# the starts of the windows of size along a side of length, the last one
+# aligned on the end of the side so that all the pixels are covered
+def window_starts(length, size, stride):
+    if length <= size:
+        return [0]
+    starts = list(range(0, length - size + 1, stride))
+    if starts[-1] != length - size:
+        starts.append(length - size)
+    return starts
+
+
+class MosaicDataset(FitsDataset):
+    """ Windows of large survey mosaics, read lazily from aligned rasters
+        instead of pre-cut files. The layout is the one of FitsDataset, with
+        the mosaics in [dataroot]/[phase]/images and the matching maps in
+        masks/ and instances/, as .npy (memory mapped) or FITS files.
+        The samples are the windows of --window_size on a grid of
+        --window_stride, or with --random_windows N, N windows drawn at
+        random positions in every epoch. Each window then goes through
+        --preprocess_mode like a file of the other datasets, and with the
+        default --preprocess_mode crop only the pixels of the crop are read.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser = FitsDataset.modify_commandline_options(parser, is_train)
+        parser.add_argument('--window_size', type=int, default=256, help='size of the windows cut from the mosaics')
+        parser.add_argument('--window_stride', type=int, default=0,
+                            help='step between the windows of the grid, --window_size if 0')
+        parser.add_argument('--random_windows', type=int, default=0,
+                            help='if > 0, # windows drawn at random positions in every epoch instead of the grid')
+        parser.set_defaults(preprocess_mode='crop')
+        parser.set_defaults(load_size=256)
+        return parser
+
+    # the windows are read lazily and there are no sketch maps
+    unsupported_options = ('preload', 'resize_cache', 'add_sketch')
+
+    def initialize(self, opt):
+        if opt.random_windows > 0:
+            assert opt.fg_crop_prob == 0 and opt.sampler != 'class_balanced' and opt.batch_sampler == 'none', \
+                '--random_windows draws new windows at every step, the samplers using per-sample indices are not supported'
+        self.initialize_options(opt)
+        self.stretch = FitsStretch(opt) if fits is not None else None
+        self.planes = OpenPlanes()
+
+        self.label_paths, self.image_paths, self.instance_paths, self.sketch_paths = self.get_sorted_paths(opt)
+        self.mosaic_sizes = []
+        for i, label_path in enumerate(self.label_paths):
+            size = self.open_plane(label_path).shape[:2]
+            planes = []
+            if self.has_images:
+                planes.append(self.open_plane(self.image_paths[i], image=True))
+            if not opt.no_instance:
+                planes.append(self.open_plane(self.instance_paths[i], dtype=np.int32))
+            for plane in planes:
+                assert plane.shape[:2] == size, 'the maps of %s are not aligned with its labels' % label_path
+            self.mosaic_sizes.append(size)
+
+        size = opt.window_size
+        if opt.random_windows > 0:
+            self.windows = None
+            # each mosaic is drawn in proportion to its number of window positions
+            self.mosaic_weights = [max(h - size + 1, 1) * max(w - size + 1, 1) for h, w in self.mosaic_sizes]
+            self.dataset_size = min(opt.random_windows, opt.max_dataset_size)
+        else:
+            stride = opt.window_stride if opt.window_stride > 0 else size
+            windows = [(i, y, x) for i, (h, w) in enumerate(self.mosaic_sizes)
+                       for y in window_starts(h, size, stride) for x in window_starts(w, size, stride)]
+            self.windows = np.array(windows, dtype=np.int64).reshape(-1, 3)[:opt.max_dataset_size]
+            self.dataset_size = len(self.windows)
+        print('%d mosaics, %d windows' % (len(self.mosaic_sizes), self.dataset_size))
+
+        self.initialize_samples(opt)
+
+    def manifest_options(self, opt):
+        options = FitsDataset.manifest_options(self, opt)
+        for name in ['window_size', 'window_stride', 'random_windows', 'max_dataset_size']:
+            options[name] = getattr(opt, name)
+        return options
+
+    def is_image_file(self, path):
+        return is_fits_file(path) or path.endswith('.npy')
+
+    def is_map_file(self, path):
+        return is_fits_file(path) or path.endswith('.npy')
+
+    def open_plane(self, path, image=False, dtype=np.uint8):
+        stretch = self.stretch if image else None
+
+        def open_file():
+            if is_fits_file(path):
+                assert fits is not None, 'reading FITS mosaics needs astropy, please install it with pip install astropy'
+                return FitsPlane(path, self.opt.fits_hdu, stretch=stretch, dtype=dtype)
+            return ArrayPlane(path, image=image, stretch=stretch, dtype=dtype)
+
+        return self.planes.get((path, image), open_file)
+
+    # (mosaic, row, column) of a window
+    def window_position(self, index):
+        if self.windows is not None:
+            return tuple(int(v) for v in self.windows[index])
+        i = random.choices(range(len(self.mosaic_sizes)), weights=self.mosaic_weights)[0]
+        h, w = self.mosaic_sizes[i]
+        size = self.opt.window_size
+        return i, random.randint(0, max(h - size, 0)), random.randint(0, max(w - size, 0))
+
+    def sample_keys(self):
+        return ['%s_%d_%d' % (self.pairing_key(self.label_paths[i]), y, x) for i, y, x in self.windows]
+
+    def read_files(self, index):
+        i, y, x = self.window_position(index)
+        h, w = self.mosaic_sizes[i]
+        h, w = min(h, self.opt.window_size), min(w, self.opt.window_size)
+
+        def window(path, image=False, dtype=np.uint8):
+            return Window(self.open_plane(path, image, dtype), y, x, h, w)
+
+        label_path = self.label_paths[i]
+        if self.has_images:
+            image_path = self.image_paths[i]
+            image = window(image_path, image=True)
+        else:
+            image_path = label_path
+            image = None
+        instance = None if self.opt.no_instance else window(self.instance_paths[i], dtype=np.int32)
+
+        # one name per window, e.g. for the results of test.py
+        stem, ext = os.path.splitext(image_path)
+        return {'label': window(label_path),
+                'image': image,
+                'instance': instance,
+                'sketch': None,
+                'path': '%s_%d_%d%s' % (stem, y, x, ext),
+                }
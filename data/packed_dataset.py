@@ -0,0 +1,65 @@
+import os
+from data import find_dataset_using_name
+from data.pix2pix_dataset import Pix2pixDataset
+from data.packing import PackedReader, packed_root
+
+
+class PackedDataset(Pix2pixDataset):
+    """ Serves the samples of another dataset_mode from the shards written by make_packed.py.
+        Use --packed_source to name the original dataset_mode (ade20k, cityscapes, celeba,
+        radiogalaxy, mask, ...) and --packed_dir for the directory holding the shards.
+        The planes are np.memmap views, so nothing is read from disk before the transforms,
+        and with --joint_transform only the pixels of the crop are read.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--packed_source', type=str, default='ade20k',
+                            help='dataset_mode the packed shards were written from')
+        parser.add_argument('--packed_dir', type=str, default='',
+                            help='directory of the packed shards, [dataroot]/packed if empty')
+        opt, _ = parser.parse_known_args()
+        source_class = find_dataset_using_name(opt.packed_source)
+        parser = source_class.modify_commandline_options(parser, is_train)
+        return parser
+
+    # the samples are not resized before the shards are read
+    unsupported_options = ('resize_cache',)
+
+    def initialize(self, opt):
+        self.initialize_options(opt)
+        self.source_class = find_dataset_using_name(opt.packed_source)
+        self.has_images = self.source_class.has_images and not opt.layout_only
+
+        self.reader = PackedReader(packed_root(opt))
+        required = ['label']
+        if self.has_images:
+            required.append('image')
+        if not opt.no_instance:
+            required.append('instance')
+        if opt.add_sketch:
+            required.append('sketch')
+        for name in required:
+            assert self.reader.has_plane(name), \
+                "The packed dataset at %s has no %s maps. Please run make_packed.py with the same options." % \
+                (self.reader.root, name)
+
+        self.dataset_size = min(len(self.reader), opt.max_dataset_size)
+
+        self.initialize_samples(opt)
+
+    def index_sources(self):
+        return [os.path.join(self.reader.root, 'index.npy')]
+
+    def sample_keys(self):
+        return [self.pairing_key(p) for p in self.reader.paths]
+
+    def read_files(self, index):
+        return self.reader.read(index)
+
+    # the samples are transformed exactly like in the source dataset
+    def process_sample(self, sample):
+        return self.source_class.process_sample(self, sample)
+
+    def postprocess(self, input_dict):
+        return self.source_class.postprocess(self, input_dict)
@@ -0,0 +1,246 @@
+"""
+Packed storage for the aligned planes (label, image, instance, sketch) of a
+Pix2pixDataset. Samples are appended to a few large binary shard files and
+located through an offset index, so that reading a sample is a slice of an
+np.memmap instead of several Image.open calls.
+
+Layout of a packed split directory:
+    shard_00000.bin, shard_00001.bin, ...   raw plane bytes
+    index.npy                               one record per sample
+    paths.txt                               the 'path' entry of each sample
+    meta.json                               dtype of every plane, counts
+
+The same layout is used in memory by PackedArena (--preload).
+"""
+
+import json
+import os
+import numpy as np
+import torch
+from PIL import Image
+
+PLANES = ('label', 'image', 'instance', 'sketch')
+
+# offsets of every plane are aligned to this many bytes
+ALIGNMENT = 8
+
+
+def to_array(plane):
+    if plane is None or isinstance(plane, np.ndarray):
+        return plane
+    return np.asarray(plane)
+
+
+def to_pil(plane):
+    if plane is None or isinstance(plane, Image.Image):
+        return plane
+    return Image.fromarray(np.ascontiguousarray(plane))
+
+
+def packed_root(opt):
+    packed_dir = opt.packed_dir if opt.packed_dir else os.path.join(opt.dataroot, 'packed')
+    return os.path.join(packed_dir, opt.phase)
+
+
+def index_dtype():
+    fields = []
+    for name in PLANES:
+        fields += [(name + '_shard', np.int32),
+                   (name + '_offset', np.int64),
+                   # (h, w, c), c == 0 for single channel planes
+                   (name + '_shape', np.int32, (3,))]
+    return np.dtype(fields)
+
+
+def plane_shape(record, name):
+    h, w, c = record[name + '_shape']
+    return (h, w, c) if c > 0 else (h, w)
+
+
+# Collects the planes of a sample as contiguous arrays, checking that their
+# dtypes agree with the previous samples. Returns the arrays and their
+# aligned size in bytes.
+def sample_arrays(sample, dtypes):
+    arrays = {}
+    nbytes = 0
+    for name in PLANES:
+        array = to_array(sample.get(name))
+        if array is None:
+            continue
+        if array.ndim not in (2, 3):
+            raise ValueError('plane %s of %s has shape %s, expected HxW or HxWxC' %
+                             (name, sample['path'], array.shape))
+        dtype = dtypes.setdefault(name, array.dtype.str)
+        if array.dtype.str != dtype:
+            raise ValueError('plane %s of %s has dtype %s, the previous samples have %s' %
+                             (name, sample['path'], array.dtype.str, dtype))
+        arrays[name] = np.ascontiguousarray(array)
+        nbytes += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    return arrays, nbytes
+
+
+# The index record of arrays stored one after the other from offset
+def make_record(arrays, shard_id, offset):
+    record = np.zeros((), dtype=index_dtype())
+    for name in PLANES:
+        if name not in arrays:
+            record[name + '_shard'] = -1
+            continue
+        array = arrays[name]
+        record[name + '_shard'] = shard_id
+        record[name + '_offset'] = offset
+        record[name + '_shape'] = array.shape if array.ndim == 3 else array.shape + (0,)
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    return record
+
+
+class PackedWriter():
+    def __init__(self, root, shard_size=1 << 30):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.shard_size = shard_size
+        self.dtypes = {}
+        self.records = []
+        self.paths = []
+        self.shard_id = -1
+        self.shard_file = None
+        self.offset = 0
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_id += 1
+        self.shard_file = open(os.path.join(self.root, 'shard_%05d.bin' % self.shard_id), 'wb')
+        self.offset = 0
+
+    def add(self, sample):
+        arrays, nbytes = sample_arrays(sample, self.dtypes)
+
+        # all the planes of a sample are kept in the same shard
+        if self.shard_file is None or (self.offset > 0 and self.offset + nbytes > self.shard_size):
+            self._next_shard()
+
+        record = make_record(arrays, self.shard_id, self.offset)
+        for name, array in arrays.items():
+            self.shard_file.write(array.tobytes())
+            self.shard_file.write(b'\0' * (-array.nbytes % ALIGNMENT))
+        self.offset += nbytes
+
+        self.records.append(record)
+        self.paths.append(str(sample['path']))
+
+    def close(self, **meta):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        np.save(os.path.join(self.root, 'index.npy'), np.array(self.records, dtype=index_dtype()))
+        with open(os.path.join(self.root, 'paths.txt'), 'w') as f:
+            for path in self.paths:
+                f.write('%s\n' % path)
+        meta.update({'planes': self.dtypes,
+                     'num_samples': len(self.records),
+                     'num_shards': self.shard_id + 1})
+        with open(os.path.join(self.root, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        print('packed %d samples into %d shards at %s' %
+              (len(self.records), self.shard_id + 1, self.root))
+
+
+class PackedReader():
+    def __init__(self, root):
+        meta_path = os.path.join(root, 'meta.json')
+        assert os.path.isfile(meta_path), \
+            '%s is not a packed dataset, please run make_packed.py first' % root
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.root = root
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in self.meta['planes'].items()}
+        self.index = np.load(os.path.join(root, 'index.npy'))
+        with open(os.path.join(root, 'paths.txt')) as f:
+            self.paths = f.read().splitlines()
+        # the shards are mapped lazily, so that every DataLoader worker
+        # maps them after the fork
+        self.shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def has_plane(self, name):
+        return name in self.dtypes
+
+    def shard(self, shard_id):
+        if shard_id not in self.shards:
+            path = os.path.join(self.root, 'shard_%05d.bin' % shard_id)
+            self.shards[shard_id] = np.memmap(path, dtype=np.uint8, mode='r')
+        return self.shards[shard_id]
+
+    # returns views into the mapped shards, nothing is copied here
+    def read(self, index):
+        record = self.index[index]
+        sample = {'path': self.paths[index]}
+        for name in PLANES:
+            shard_id = record[name + '_shard']
+            if name not in self.dtypes or shard_id < 0:
+                sample[name] = None
+                continue
+            dtype = self.dtypes[name]
+            shape = plane_shape(record, name)
+            offset = int(record[name + '_offset'])
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            buffer = self.shard(int(shard_id))[offset:offset + nbytes]
+            sample[name] = buffer.view(dtype).reshape(shape)
+        return sample
+
+
+class PackedArena(PackedReader):
+    """ All the samples of a dataset decoded once into shared memory.
+        DataLoader workers index into the same buffers instead of decoding
+        the files again in every epoch. Like the shards of PackedWriter, the
+        buffers of shard_size bytes are allocated as the samples come and
+        every sample is copied in as soon as it is decoded, so that the
+        decoded samples are never held twice.
+    """
+
+    def __init__(self, samples, shard_size=1 << 26):
+        self.dtypes = {}
+        self.buffers = []
+        records = []
+        paths = []
+        offset = 0
+        size = 0
+        for sample in samples:
+            sample_planes, nbytes = sample_arrays(sample, self.dtypes)
+            # all the planes of a sample are kept in the same buffer
+            if len(self.buffers) == 0 or offset + nbytes > self.buffers[-1].numel():
+                self.buffers.append(torch.empty(max(shard_size, nbytes, 1), dtype=torch.uint8).share_memory_())
+                offset = 0
+            record = make_record(sample_planes, len(self.buffers) - 1, offset)
+            buffer = self.buffers[-1].numpy()
+            for name, array in sample_planes.items():
+                start = int(record[name + '_offset'])
+                buffer[start:start + array.nbytes] = array.reshape(-1).view(np.uint8)
+            records.append(record)
+            paths.append(str(sample['path']))
+            offset += nbytes
+            size += nbytes
+
+        self.size = size
+        self.meta = {'planes': self.dtypes, 'num_samples': len(records), 'num_shards': len(self.buffers)}
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in self.dtypes.items()}
+        self.root = '<shared memory>'
+        self.index = np.array(records, dtype=index_dtype())
+        self.paths = paths
+        self.shards = {}
+
+    # the bytes of the samples, the buffers are allocated by shard_size
+    def nbytes(self):
+        return self.size
+
+    def shard(self, shard_id):
+        if shard_id not in self.shards:
+            self.shards[shard_id] = self.buffers[shard_id].numpy()
+        return self.shards[shard_id]
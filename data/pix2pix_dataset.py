@@ -3,41 +3,72 @@ Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
 Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
 """
 
-from data.base_dataset import BaseDataset, get_params, get_transform
+from data.base_dataset import BaseDataset, JointTransform, array_to_tensor, get_params, get_transform
+from data.image_folder import load_manifest, manifest_file, save_manifest
+from data.packing import PackedArena, to_pil
+from data.resize_cache import ResizeCache
+from data.sample_index import foreground_box, sample_index
 from PIL import Image
+from tqdm import tqdm
 import util.util as util
+import torch
+import numpy as np
 import os
 
 
+def report_paths(message, paths, num_examples=3):
+    print('%s, e.g. %s' % (message, ', '.join(paths[:num_examples])))
+
+
 class Pix2pixDataset(BaseDataset):
+    # datasets such as MaskDataset only provide label maps
+    has_images = True
+    # decoded samples when using --preload
+    arena = None
+    # the transform plan when using --joint_transform
+    joint_transform = None
+    # pre-resized samples when using --resize_cache
+    resize_cache = None
+    # the foreground box of every sample when using --fg_crop_prob
+    fg_boxes = None
+    # the (h, w) of every sample when using --batch_sampler size_bucket
+    bucket_sizes = None
+    # options of Pix2pixDataset that a subclass can not serve, rejected by
+    # initialize_options
+    unsupported_options = ()
+
     @staticmethod
     def modify_commandline_options(parser, is_train):
         parser.add_argument('--no_pairing_check', action='store_true',
-                            help='If specified, skip sanity check of correct label-image file pairing')
+                            help='If specified, pair the label and image files by their position in the sorted lists instead of by their names')
+        parser.add_argument('--no_manifest', action='store_true',
+                            help='If specified, scan the dataset directories at every start instead of reading the file manifest')
+        parser.add_argument('--index_dir', type=str, default='',
+                            help='where to store the file manifest and other dataset indices, [dataroot]/.index if empty')
+        parser.add_argument('--joint_transform', action='store_true',
+                            help='If specified, resize/crop/flip all the maps of a sample in one pass on numpy arrays instead of one PIL pipeline per map')
+        parser.add_argument('--resize_cache', action='store_true',
+                            help='If specified, store the samples resized to load_size in [index_dir] during the first epoch and read them from there afterwards')
+        parser.add_argument('--fg_crop_prob', type=float, default=0.0,
+                            help='probability of placing the training crop over the foreground of the sample instead of uniformly')
+        parser.add_argument('--fg_boxes', type=str, default='',
+                            help='COCO annotation file giving the foreground boxes for --fg_crop_prob. If empty, the boxes are computed from the label maps')
+        parser.add_argument('--layout_only', action='store_true',
+                            help='If specified, the real images are neither read nor returned, for inference from the label/instance/sketch maps only')
+        parser.add_argument('--preload', action='store_true',
+                            help='If specified, decode all samples once into shared memory, so that the DataLoader workers do not read the files in every epoch. Only for datasets that fit in RAM')
         return parser
 
     def initialize(self, opt):
-        self.opt = opt
-
-        label_paths, image_paths, instance_paths, sketch_paths = self.get_paths(opt)
+        self.initialize_options(opt)
 
-        util.natural_sort(label_paths)
-        util.natural_sort(image_paths)
-        if not opt.no_instance:
-            util.natural_sort(instance_paths)
-        if opt.add_sketch:
-            util.natural_sort(sketch_paths)
+        label_paths, image_paths, instance_paths, sketch_paths = self.get_sorted_paths(opt)
 
         label_paths = label_paths[:opt.max_dataset_size]
         image_paths = image_paths[:opt.max_dataset_size]
         instance_paths = instance_paths[:opt.max_dataset_size]
         sketch_paths = sketch_paths[:opt.max_dataset_size]
 
-        if not opt.no_pairing_check:
-            for path1, path2 in zip(label_paths, image_paths):
-                assert self.paths_match(path1, path2), \
-                    "The label-image pair (%s, %s) do not look like the right pair because the filenames are quite different. Are you sure about the pairing? Please see data/pix2pix_dataset.py to see what is going on, and use --no_pairing_check to bypass this." % (path1, path2)
-
         self.label_paths = label_paths
         self.image_paths = image_paths
         self.instance_paths = instance_paths
@@ -46,6 +77,151 @@ class Pix2pixDataset(BaseDataset):
         size = len(self.label_paths)
         self.dataset_size = size
 
+        self.initialize_samples(opt)
+
+    # The first step of initialize, for all the datasets: checks the options
+    # and sets has_images
+    def initialize_options(self, opt):
+        self.opt = opt
+        for name in self.unsupported_options:
+            assert not getattr(opt, name), '--dataset_mode %s does not support --%s' % (opt.dataset_mode, name)
+        if opt.layout_only:
+            assert not opt.isTrain, '--layout_only is only for inference'
+            self.has_images = False
+
+    # The last step of initialize, once the samples are listed and
+    # dataset_size is known: the transform plan, caches and indices
+    def initialize_samples(self, opt):
+        if opt.joint_transform:
+            self.joint_transform = JointTransform(opt)
+
+        if opt.resize_cache:
+            self.resize_cache = ResizeCache(opt, self.manifest_options(opt))
+
+        if opt.preload:
+            self.preload()
+
+        if opt.isTrain and opt.fg_crop_prob > 0:
+            self.fg_boxes = self.foreground_boxes(opt)
+
+    # (x0, y0, x1, y1) foreground box of every sample, in fractions of its size
+    def foreground_boxes(self, opt):
+        if opt.fg_boxes:
+            from data.galaxy import foreground_boxes
+            table = foreground_boxes(opt.fg_boxes)
+            boxes = np.array([table.get(key, [0, 0, 0, 0]) for key in self.sample_keys()], dtype=np.float32)
+        else:
+            boxes = sample_index(self, 'foreground', foreground_box)
+        print('%d of %d samples have a foreground box' % ((boxes[:, 2] > boxes[:, 0]).sum(), len(boxes)))
+        return boxes
+
+    def preload(self):
+        samples = (self.load_sample(i) for i in tqdm(range(self.dataset_size), desc='preload'))
+        self.arena = PackedArena(samples)
+        print('preloaded %d samples (%.1f MB) into shared memory' %
+              (self.dataset_size, self.arena.nbytes() / 2 ** 20))
+
+    # get_paths followed by pairing, cached in a manifest that is
+    # invalidated when any of the dataset directories changes
+    def get_sorted_paths(self, opt):
+        if not opt.no_manifest:
+            options = self.manifest_options(opt)
+            path = manifest_file(opt, options)
+            paths = load_manifest(path, options)
+            if paths is not None:
+                return paths['label'], paths['image'], paths['instance'], paths['sketch']
+
+        label_paths, image_paths, instance_paths, sketch_paths = self.get_paths(opt)
+
+        if opt.no_pairing_check:
+            # pair the files by their position in the sorted lists
+            util.natural_sort(label_paths)
+            util.natural_sort(image_paths)
+            if not opt.no_instance:
+                util.natural_sort(instance_paths)
+            if opt.add_sketch:
+                util.natural_sort(sketch_paths)
+        else:
+            label_paths, image_paths, instance_paths, sketch_paths = \
+                self.pair_paths(opt, label_paths, image_paths, instance_paths, sketch_paths)
+
+        if not opt.no_manifest:
+            save_manifest(path, options, {'label': label_paths,
+                                          'image': image_paths,
+                                          'instance': instance_paths,
+                                          'sketch': sketch_paths})
+
+        return label_paths, image_paths, instance_paths, sketch_paths
+
+    # Joins the image, instance and sketch paths to the label paths on
+    # pairing_key. Labels missing any of the required files are dropped and
+    # reported, as well as files that no label refers to.
+    def pair_paths(self, opt, label_paths, image_paths, instance_paths, sketch_paths):
+        columns = []
+        if self.has_images:
+            columns.append(('image', image_paths))
+        if not opt.no_instance:
+            columns.append(('instance', instance_paths))
+        if opt.add_sketch:
+            columns.append(('sketch', sketch_paths))
+
+        tables = {}
+        for name, paths in columns:
+            table = {}
+            duplicates = []
+            for path in paths:
+                key = self.pairing_key(path)
+                if key in table:
+                    duplicates.append(path)
+                else:
+                    table[key] = path
+            if len(duplicates) > 0:
+                report_paths('%d %s files have the same name as another one and are ignored' %
+                             (len(duplicates), name), duplicates)
+            tables[name] = table
+
+        util.natural_sort(label_paths)
+        paired = {name: [] for name in ['label', 'image', 'instance', 'sketch']}
+        used_keys = set()
+        missing = {name: [] for name, _ in columns}
+        duplicates = []
+        for label_path in label_paths:
+            key = self.pairing_key(label_path)
+            if key in used_keys:
+                duplicates.append(label_path)
+                continue
+            matches = {name: table.get(key) for name, table in tables.items()}
+            unmatched = [name for name, match in matches.items() if match is None]
+            for name in unmatched:
+                missing[name].append(label_path)
+            if len(unmatched) > 0:
+                continue
+            used_keys.add(key)
+            paired['label'].append(label_path)
+            for name, match in matches.items():
+                paired[name].append(match)
+
+        if len(duplicates) > 0:
+            report_paths('%d label maps have the same name as another one and are ignored' %
+                         len(duplicates), duplicates)
+        for name, paths in missing.items():
+            if len(paths) > 0:
+                report_paths('%d label maps have no %s file and are dropped' % (len(paths), name), paths)
+        for name, table in tables.items():
+            unused = [path for key, path in table.items() if key not in used_keys]
+            if len(unused) > 0:
+                report_paths('%d %s files have no label map and are ignored' % (len(unused), name), unused)
+
+        return paired['label'], paired['image'], paired['instance'], paired['sketch']
+
+    # the options that change the result of get_paths
+    def manifest_options(self, opt):
+        names = ['dataset_mode', 'dataroot', 'phase', 'no_instance', 'add_sketch', 'norm_mode',
+                 'no_pairing_check', 'layout_only', 'label_dir', 'image_dir', 'instance_dir']
+        options = {name: getattr(opt, name) for name in names if hasattr(opt, name)}
+        options['class'] = type(self).__name__
+        return options
+
     def get_paths(self, opt):
         label_paths = []
         image_paths = []
@@ -54,40 +230,136 @@ class Pix2pixDataset(BaseDataset):
         assert False, "A subclass of Pix2pixDataset must override self.get_paths(self, opt)"
         return label_paths, image_paths, instance_paths, sketch_paths
 
+    # the files the per-sample indices of data/sample_index.py depend on
+    def index_sources(self):
+        return self.label_paths + self.instance_paths
+
+    # the pairing_key of every sample, in order
+    def sample_keys(self):
+        return [self.pairing_key(p) for p in self.label_paths]
+
+    # the files of a sample are paired on this key
+    def pairing_key(self, path):
+        return os.path.splitext(os.path.basename(path))[0]
+
     def paths_match(self, path1, path2):
-        filename1_without_ext = os.path.splitext(os.path.basename(path1))[0]
-        filename2_without_ext = os.path.splitext(os.path.basename(path2))[0]
-        return filename1_without_ext == filename2_without_ext
+        return self.pairing_key(path1) == self.pairing_key(path2)
 
     def __getitem__(self, index):
-        # Label Image
+        sample = self.load_sample(index)
+        if not self.has_images:
+            # packed or cached samples may have one
+            sample['image'] = None
+        if self.fg_boxes is not None:
+            sample['fg_box'] = self.fg_boxes[index]
+        if self.bucket_sizes is not None:
+            sample['resize'] = self.bucket_sizes[index]
+        return self.process_sample(sample)
+
+    # Read the raw planes of one sample. Each plane is a PIL image or a
+    # numpy array (see data/packing.py), or None if it is not used.
+    # Subclasses reading from other storage only need to override
+    # read_files, the samples then also go through --preload.
+    def load_sample(self, index):
+        if self.arena is not None:
+            return self.arena.read(index)
+
+        if self.resize_cache is not None:
+            key = self.pairing_key(self.label_paths[index])
+            sample = self.resize_cache.load(key)
+            if sample is None:
+                sample = self.resize_cache.save(key, self.read_files(index))
+            sample['path'] = self.image_paths[index] if self.has_images else self.label_paths[index]
+            return sample
+
+        return self.read_files(index)
+
+    def read_files(self, index):
         label_path = self.label_paths[index]
         label = Image.open(label_path)
-        params = get_params(self.opt, label.size)
+
+        if self.has_images:
+            image_path = self.image_paths[index]
+            image = Image.open(image_path)
+            if self.resize_cache is not None:
+                # decode large JPEGs at a reduced resolution
+                self.resize_cache.draft(image, label.size)
+            image = image.convert('RGB')
+        else:
+            image_path = label_path
+            image = None
+
+        if self.opt.no_instance:
+            instance = None
+        else:
+            instance = Image.open(self.instance_paths[index])
+
+        if not self.opt.add_sketch:
+            sketch = None
+        else:
+            sketch = Image.open(self.sketch_paths[index])
+
+        return {'label': label,
+                'image': image,
+                'instance': instance,
+                'sketch': sketch,
+                'path': image_path,
+                }
+
+    def process_sample(self, sample):
+        label_tensor, image_tensor, instance_tensor, sketch_tensor = self.transform_sample(sample)
+        # out of place, the tensor may share the memory of the sample
+        label_tensor = label_tensor.masked_fill(label_tensor == 255, self.opt.label_nc)  # 'unknown' is opt.label_nc
+
+        input_dict = {'label': label_tensor,
+                      'instance': instance_tensor,
+                      'image': image_tensor,
+                      'sketch': sketch_tensor,
+                      'path': sample['path'],
+                      }
+        # with --layout_only there is no image, and None can not be collated
+        if image_tensor is None:
+            del input_dict['image']
+
+        # Give subclasses a chance to modify the final output
+        self.postprocess(input_dict)
+
+        return input_dict
+
+    # Applies the random resize/crop/flip to all the planes of a sample and
+    # returns them as tensors. Label values are in [0, 255], the image
+    # is normalized unless using --uint8_pipeline.
+    def transform_sample(self, sample):
+        if self.opt.batch_augment:
+            return self.full_size_sample(sample)
+        if self.opt.joint_transform:
+            return self.joint_transform_sample(sample)
+
+        # Label Image
+        label = to_pil(sample['label'])
+        params = get_params(self.opt, label.size, sample.get('fg_box'), sample.get('resize'))
         transform_label = get_transform(self.opt, params, method=Image.NEAREST, normalize=False)
-        label_tensor = transform_label(label) * 255.0
-        label_tensor[label_tensor == 255] = self.opt.label_nc  # 'unknown' is opt.label_nc
+        label_tensor = transform_label(label)
+        if not self.opt.uint8_pipeline:
+            label_tensor = label_tensor * 255.0
 
         # input image (real images)
-        image_path = self.image_paths[index]
-        assert self.paths_match(label_path, image_path), \
-            "The label_path %s and image_path %s don't match." % \
-            (label_path, image_path)
-        image = Image.open(image_path)
-        image = image.convert('RGB')
-
-        transform_image = get_transform(self.opt, params)
-        image_tensor = transform_image(image)
+        if sample['image'] is None:
+            image_tensor = None
+        else:
+            image = to_pil(sample['image'])
+            transform_image = get_transform(self.opt, params)
+            image_tensor = transform_image(image)
 
         # if using instance maps
         if self.opt.no_instance:
             instance_tensor = 0
         else:
-            instance_path = self.instance_paths[index]
-            instance = Image.open(instance_path)
+            instance = to_pil(sample['instance'])
             if instance.mode == 'L':
-                instance_tensor = transform_label(instance) * 255
-                instance_tensor = instance_tensor.long()
+                instance_tensor = transform_label(instance)
+                if not self.opt.uint8_pipeline:
+                    instance_tensor = (instance_tensor * 255).long()
             else:
                 instance_tensor = transform_label(instance)
 
@@ -96,21 +368,56 @@ class Pix2pixDataset(BaseDataset):
             sketch_tensor = 0
         else:
             # sketch range is 0 and 255
-            sketch_path = self.sketch_paths[index]
-            sketch = Image.open(sketch_path)
+            sketch = to_pil(sample['sketch'])
             sketch_tensor = transform_label(sketch)
 
-        input_dict = {'label': label_tensor,
-                      'instance': instance_tensor,
-                      'image': image_tensor,
-                      'sketch': sketch_tensor,
-                      'path': image_path,
-                      }
+        return label_tensor, image_tensor, instance_tensor, sketch_tensor
 
-        # Give subclasses a chance to modify the final output
-        self.postprocess(input_dict)
+    # with --batch_augment the planes are returned untransformed, see
+    # data/batch_augment.py. They are copied, as the arrays of PIL images,
+    # packed shards and the --preload arena are read-only.
+    def full_size_sample(self, sample):
+        tensors = []
+        for name in ['label', 'image', 'instance', 'sketch']:
+            if sample[name] is None:
+                tensors.append(None if name == 'image' else 0)
+            else:
+                tensors.append(array_to_tensor(np.array(sample[name])))
+        return tuple(tensors)
 
-        return input_dict
+    # same as above with the JointTransform compiled in initialize
+    def joint_transform_sample(self, sample):
+        h, w = np.shape(sample['label'])[:2]
+        params = get_params(self.opt, (w, h), sample.get('fg_box'), sample.get('resize'))
+        planes = self.joint_transform(sample, params)
+        uint8 = self.opt.uint8_pipeline
+
+        label_tensor = array_to_tensor(planes['label'])
+        if not uint8:
+            label_tensor = label_tensor.float()
+
+        if planes['image'] is None:
+            image_tensor = None
+        else:
+            image_tensor = array_to_tensor(planes['image'])
+            if not uint8:
+                image_tensor = image_tensor.float().div_(127.5).sub_(1.0)
+
+        if self.opt.no_instance:
+            instance_tensor = 0
+        else:
+            instance_tensor = array_to_tensor(planes['instance'])
+            if not uint8 and instance_tensor.dtype == torch.uint8:
+                instance_tensor = instance_tensor.long()
+
+        if not self.opt.add_sketch:
+            sketch_tensor = 0
+        else:
+            sketch_tensor = array_to_tensor(planes['sketch'])
+            if not uint8 and sketch_tensor.dtype == torch.uint8:
+                sketch_tensor = sketch_tensor.float().div_(255.0)
+
+        return label_tensor, image_tensor, instance_tensor, sketch_tensor
 
     def postprocess(self, input_dict):
         return input_dict
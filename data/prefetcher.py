@@ -0,0 +1,108 @@
+from queue import Empty, Queue
+from threading import Event, Thread
+import torch
+
+
+def batch_tensors(obj):
+    if torch.is_tensor(obj):
+        yield obj
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from batch_tensors(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from batch_tensors(value)
+
+
+class DevicePrefetcher():
+    """ Wraps a DataLoader so that the next batch is copied to the GPU and turned
+        into the network inputs by preprocess (Pix2PixModel.preprocess_input) on a
+        side CUDA stream while the current batch is used (--device_prefetch). The
+        inputs are stored in batch['inputs'] and Pix2PixModel.forward uses them
+        instead of preprocessing the batch again. Without a GPU, the batches are
+        prepared by a background thread instead.
+    """
+
+    def __init__(self, loader, preprocess=None, use_cuda=True, depth=2):
+        self.loader = loader
+        self.preprocess = preprocess
+        self.use_cuda = use_cuda and torch.cuda.is_available()
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    def prepare(self, batch):
+        if self.use_cuda:
+            batch = {key: value.cuda(non_blocking=True) if torch.is_tensor(value) else value
+                     for key, value in batch.items()}
+        if self.preprocess is not None:
+            batch['inputs'] = self.preprocess(batch)
+        return batch
+
+    def __iter__(self):
+        if self.use_cuda:
+            return self.stream_batches()
+        return self.thread_batches()
+
+    def stage(self, batches, stream):
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(stream):
+            return self.prepare(batch)
+
+    def stream_batches(self):
+        stream = torch.cuda.Stream()
+        batches = iter(self.loader)
+        next_batch = self.stage(batches, stream)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_stream(stream)
+            batch = next_batch
+            # the memory of the batch must not be reused by the side stream
+            # before the current stream is done with it
+            for tensor in batch_tensors(batch):
+                if tensor.is_cuda:
+                    tensor.record_stream(current_stream)
+            next_batch = self.stage(batches, stream)
+            yield batch
+
+    def thread_batches(self):
+        queue = Queue(self.depth)
+        stop = Event()
+        end = object()
+
+        def produce():
+            try:
+                for batch in self.loader:
+                    if stop.is_set():
+                        return
+                    queue.put(self.prepare(batch))
+                queue.put(end)
+            except Exception as e:
+                queue.put(e)
+
+        thread = Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # unblocks the producer if it waits on a full queue
+            while thread.is_alive():
+                try:
+                    queue.get(timeout=0.1)
+                except Empty:
+                    pass
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from PIL import Image
+from data.base_dataset import JointTransform
+from data.image_folder import index_root, options_digest
+from data.packing import PLANES, to_pil
+
+
+class ResizeCache():
+    """ Samples stored already resized to the size that the transforms of
+        opt.preprocess_mode produce before cropping (--resize_cache). The
+        cache is keyed by the options that decide this size and by the
+        manifest options of the dataset (mode, dataroot, planes), so the
+        random crop/flip still happen at every epoch, on the small arrays.
+        Delete the cache directory when the files of the dataset change.
+    """
+
+    def __init__(self, opt, options):
+        self.plan = JointTransform(opt)
+        name = 'resized_%s_%d_%d_%g_%s' % (opt.preprocess_mode, opt.load_size, opt.crop_size, opt.aspect_ratio,
+                                           options_digest(options))
+        self.root = os.path.join(index_root(opt), name, opt.phase)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as arrays:
+            return {name: arrays[name] if name in arrays else None for name in PLANES}
+
+    # Lets PIL decode a JPEG at 1/2, 1/4 or 1/8 of its resolution when the
+    # target is at least twice smaller than the image. The target is the
+    # resized size of the sample, i.e. of its label map (size), which may
+    # be smaller than the image. Has no effect on other formats.
+    def draft(self, image, size):
+        new_w, new_h = self.plan.resized_size(*size)
+        if new_w * 2 <= image.size[0] and new_h * 2 <= image.size[1]:
+            image.draft('RGB', (new_w, new_h))
+
+    def save(self, key, sample):
+        # the label size is the original size of the sample, the image
+        # may have been decoded smaller by draft
+        w, h = to_pil(sample['label']).size
+        new_size = self.plan.resized_size(w, h)
+        arrays = {}
+        for name in PLANES:
+            plane = to_pil(sample[name])
+            if plane is None:
+                continue
+            if plane.size != new_size:
+                method = Image.BICUBIC if name == 'image' else Image.NEAREST
+                plane = plane.resize(new_size, method)
+            arrays[name] = np.asarray(plane)
+
+        path = self.path(key)
+        # np.savez appends .npz to names without it
+        tmp_path = '%s.%d.tmp.npz' % (path[:-4], os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+        cached = {name: arrays.get(name) for name in PLANES}
+        return cached
@@ -0,0 +1,132 @@
+"""
+Per-sample indices of a Pix2pixDataset: a small array of statistics for
+every sample (number of instances, class histogram, foreground box, ...)
+computed once with a pool of processes and stored in index_root, next to
+the file manifest. An index is computed again when the options of the
+dataset, its files or the mtimes of their directories change.
+"""
+
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+import numpy as np
+from tqdm import tqdm
+from data.image_folder import index_root, load_index_json, save_index_json
+from data.packing import to_array
+
+# the function and state of the running pool_map, set in every worker
+_worker_state = {}
+
+
+def _init_worker(function, state):
+    _worker_state['function'] = function
+    _worker_state['state'] = state
+
+
+def _call_worker(item):
+    return _worker_state['function'](_worker_state['state'], item)
+
+
+# [function(state, item) for item in items] computed by num_workers
+# processes, or by this one if 0. state (e.g. the dataset) is sent once to
+# every worker instead of with every item, and function must be a module
+# level function.
+def pool_map(function, state, items, num_workers, desc=None):
+    if num_workers > 0:
+        with Pool(num_workers, initializer=_init_worker, initargs=(function, state)) as pool:
+            return list(tqdm(pool.imap(_call_worker, items, chunksize=16), total=len(items), desc=desc))
+    return [function(state, item) for item in tqdm(items, desc=desc)]
+
+
+def _compute_one(state, index):
+    dataset, compute = state
+    return compute(dataset.load_sample(index))
+
+
+def index_file(dataset, name, options):
+    opt = dataset.opt
+    key = json.dumps([options, dataset.index_sources()], sort_keys=True)
+    digest = hashlib.md5(key.encode()).hexdigest()[:8]
+    return os.path.join(index_root(opt), '%s_%s_%s_%s' % (name, opt.dataset_mode, opt.phase, digest))
+
+
+# Returns the array of compute(sample) for all the samples of dataset.
+# compute must be a module level function, so that it can be sent to the
+# worker processes, and return arrays of the same shape for every sample.
+# Anything else compute depends on goes in options.
+def sample_index(dataset, name, compute, options=None):
+    opt = dataset.opt
+    index_options = dataset.manifest_options(opt)
+    index_options.update({'index': name, 'size': len(dataset)})
+    if options is not None:
+        index_options.update(options)
+    path = index_file(dataset, name, index_options)
+
+    values = load_sample_index(path, index_options)
+    if values is not None:
+        return values
+
+    results = pool_map(_compute_one, (dataset, compute), range(len(dataset)), int(opt.nThreads),
+                       desc='computing the %s index' % name)
+    values = np.stack([np.asarray(r) for r in results])
+
+    save_sample_index(path, index_options, dataset.index_sources(), values)
+    return values
+
+
+def load_sample_index(path, options):
+    # returns None if the index is missing or out of date
+    if not os.path.isfile(path + '.npy') or load_index_json(path + '.json', options) is None:
+        return None
+    return np.load(path + '.npy')
+
+
+def save_sample_index(path, options, sources, values):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # np.save appends .npy to names without it
+        np.save(path + '.tmp.npy', values)
+        os.replace(path + '.tmp.npy', path + '.npy')
+    except OSError as e:
+        print('could not write sample index at %s: %s' % (path, e))
+        return
+    # the JSON file is written last, it validates the values
+    save_index_json(path + '.json', options, sources, {}, 'sample index')
+
+
+# size of the one-hot instance map of a sample, see Pix2PixModel.preprocess_input
+def instance_count(sample):
+    instance = to_array(sample['instance'])
+    if instance is None:
+        return 0
+    return int(instance.max()) + 1
+
+
+# (h, w) of the label map of a sample
+def sample_size(sample):
+    return np.array(np.shape(sample['label'])[:2], dtype=np.int64)
+
+
+# pixels of every class in the label map of a sample. Values from
+# num_classes - 1 up (the 'unknown' 255) are counted in the last bin.
+def class_histogram(sample, num_classes):
+    label = to_array(sample['label'])
+    label = np.minimum(label.reshape(-1).astype(np.int64), num_classes - 1)
+    return np.bincount(label, minlength=num_classes).astype(np.int64)
+
+
+# (x0, y0, x1, y1) box of the labelled pixels of a sample, in fractions of
+# its width and height. Label 0 is the background (or unknown) and 255 is
+# unknown. Samples without foreground have an empty box.
+def foreground_box(sample):
+    label = to_array(sample['label'])
+    foreground = (label != 0) & (label != 255)
+    if foreground.ndim == 3:
+        foreground = foreground.any(2)
+    rows = np.flatnonzero(foreground.any(1))
+    cols = np.flatnonzero(foreground.any(0))
+    if len(rows) == 0:
+        return np.zeros(4, dtype=np.float32)
+    h, w = foreground.shape
+    return np.array([cols[0] / w, rows[0] / h, (cols[-1] + 1) / w, (rows[-1] + 1) / h], dtype=np.float32)
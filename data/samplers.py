@@ -0,0 +1,162 @@
+import json
+import os
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class InstanceBucketBatchSampler(Sampler):
+    """ Batches of samples with similar instance counts (--batch_sampler instance_bucket).
+        The one-hot instance map of a batch has as many channels as the largest
+        instance id in it, so a single crowded sample makes the whole batch expensive.
+        The shuffled samples are taken bucket_batches * batch_size at a time, sorted by
+        instance count and cut into batches, and the batches are shuffled again.
+    """
+
+    def __init__(self, counts, batch_size, drop_last, shuffle=True, bucket_batches=50):
+        self.counts = np.asarray(counts)
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * max(bucket_batches, 1)
+
+    def __iter__(self):
+        n = len(self.counts)
+        order = torch.randperm(n).numpy() if self.shuffle else np.arange(n)
+        batches = []
+        for start in range(0, n, self.bucket_size):
+            bucket = order[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.counts[bucket], kind='stable')]
+            for i in range(0, len(bucket), self.batch_size):
+                batches.append(bucket[i:i + self.batch_size])
+        # the bucket size is a multiple of the batch size, only the last batch can be smaller
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.counts) // self.batch_size
+        return (len(self.counts) + self.batch_size - 1) // self.batch_size
+
+
+class SizeBucketBatchSampler(Sampler):
+    """ Batches of samples of the same size (--batch_sampler size_bucket), for
+        --preprocess_mode none where every sample keeps its own size. sizes are
+        the (h, w) each sample is resized to, see bucket_sizes. The samples of
+        each size are shuffled and cut into batches, and the batches of all the
+        sizes are shuffled together. With drop_last, the incomplete batch of
+        every size is dropped.
+    """
+
+    def __init__(self, sizes, batch_size, drop_last, shuffle=True):
+        _, self.buckets = np.unique(np.asarray(sizes), axis=0, return_inverse=True)
+        self.buckets = self.buckets.reshape(-1)
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        n = len(self.buckets)
+        order = torch.randperm(n).numpy() if self.shuffle else np.arange(n)
+        order = order[np.argsort(self.buckets[order], kind='stable')]
+        starts = np.flatnonzero(np.diff(self.buckets[order], prepend=-1))
+        batches = []
+        for bucket in np.split(order, starts[1:]):
+            for i in range(0, len(bucket), self.batch_size):
+                batch = bucket[i:i + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        counts = np.bincount(self.buckets)
+        if self.drop_last:
+            return int((counts // self.batch_size).sum())
+        return int(((counts + self.batch_size - 1) // self.batch_size).sum())
+
+
+class ResumableSampler(Sampler):
+    """ Random order of the samples drawn from --sampler_seed and the epoch (--sampler resumable).
+        The order of an epoch is the same in every run, so a run resumed with --continue_train
+        skips the samples the interrupted run had already used, without loading them.
+        The seed and the position reached are saved next to iter.txt.
+    """
+
+    def __init__(self, size, seed, shuffle=True):
+        self.size = size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.start = 0
+
+    # the next iterations start at sample start of the order of epoch
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def permutation(self):
+        if not self.shuffle:
+            return torch.arange(self.size)
+        generator = torch.Generator()
+        # different seeds do not give the same orders shifted by some epochs
+        generator.manual_seed(self.seed * 100003 + self.epoch)
+        return torch.randperm(self.size, generator=generator)
+
+    def __iter__(self):
+        return iter(self.permutation()[self.start:].tolist())
+
+    def __len__(self):
+        return self.size - self.start
+
+    def save_state(self, path, position):
+        state = {'seed': self.seed, 'size': self.size, 'shuffle': self.shuffle,
+                 'epoch': self.epoch, 'position': position}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    # Returns the position to resume epoch from, 0 if the saved state is
+    # missing or was written with another order of the samples
+    def resume(self, path, epoch, position):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print('Could not load the sampler state at %s. Starting epoch %d from the beginning.' % (path, epoch))
+            return 0
+        same_order = (state['seed'], state['size'], state['shuffle']) == (self.seed, self.size, self.shuffle)
+        if not same_order or state['epoch'] != epoch or state['position'] != position:
+            print('The sampler state at %s does not match the iteration record. Starting epoch %d from the beginning.' %
+                  (path, epoch))
+            return 0
+        print('Skipping the first %d samples of epoch %d' % (position, epoch))
+        return position
+
+
+# Sampling weights making the samples with rare classes more frequent
+# (--sampler class_balanced). A class present in a fraction f of the samples
+# weighs f^-power, and a sample weighs as much as its rarest class. The last
+# bin of the histograms, the 'unknown' class, is not taken into account.
+def class_balanced_weights(histograms, power=0.5):
+    present = histograms[:, :-1] > 0
+    frequency = present.mean(0)
+    class_weights = np.zeros_like(frequency)
+    class_weights[frequency > 0] = frequency[frequency > 0] ** -power
+    weights = (present * class_weights).max(1)
+    # samples with only unknown pixels keep the weight of the most common class
+    weights[weights == 0] = 1.0
+    return weights
+
+
+# The (h, w) the samples are resized to with --batch_sampler size_bucket:
+# their own size rounded to a multiple of step, so that the samples within
+# step / 2 pixels of each other share a bucket
+def bucket_sizes(sizes, step):
+    return np.maximum(np.round(np.asarray(sizes) / step), 1).astype(np.int64) * step
@@ -0,0 +1,105 @@
+import numpy as np
+from data.pix2pix_dataset import Pix2pixDataset
+
+
+class SyntheticDataset(Pix2pixDataset):
+    """ Procedural samples kept in memory, to measure the throughput of the
+        model and of the training loop without reading any file. A pool of
+        --synthetic_pool samples is drawn at start: each one has between
+        --min_instances and --max_instances elliptic instances over a
+        background, with classes drawn with probabilities proportional to
+        (class + 1)^-power (--class_power, 0 is uniform). The label, instance
+        and sketch maps and the image are --synthetic_height x --synthetic_width
+        (crop_size / aspect_ratio x crop_size by default), and the dataset
+        serves the pool in a loop for --synthetic_samples samples.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser = Pix2pixDataset.modify_commandline_options(parser, is_train)
+        parser.add_argument('--synthetic_samples', type=int, default=1000, help='# samples of an epoch')
+        parser.add_argument('--synthetic_pool', type=int, default=16, help='# distinct samples drawn and kept in memory')
+        parser.add_argument('--synthetic_height', type=int, default=0,
+                            help='height of the samples, crop_size / aspect_ratio if 0')
+        parser.add_argument('--synthetic_width', type=int, default=0, help='width of the samples, crop_size if 0')
+        parser.add_argument('--min_instances', type=int, default=1, help='min # instances of a sample')
+        parser.add_argument('--max_instances', type=int, default=10, help='max # instances of a sample')
+        parser.add_argument('--class_power', type=float, default=0.0,
+                            help='classes are drawn with probabilities proportional to (class + 1)^-power')
+        parser.add_argument('--synthetic_seed', type=int, default=0, help='seed of the samples')
+        parser.set_defaults(preprocess_mode='none')
+        parser.set_defaults(label_nc=4)
+        parser.set_defaults(contain_dontcare_label=True)
+        return parser
+
+    # the samples have no files, and the pool is already in memory
+    unsupported_options = ('preload', 'resize_cache')
+
+    def initialize(self, opt):
+        assert 1 <= opt.min_instances <= opt.max_instances, '--min_instances must be in [1, --max_instances]'
+        self.initialize_options(opt)
+        self.label_paths, self.image_paths, self.instance_paths, self.sketch_paths = [], [], [], []
+
+        w = opt.synthetic_width if opt.synthetic_width > 0 else opt.crop_size
+        h = opt.synthetic_height if opt.synthetic_height > 0 else round(opt.crop_size / opt.aspect_ratio)
+        rng = np.random.default_rng(opt.synthetic_seed)
+        self.samples = [self.draw_sample(rng, h, w) for _ in range(opt.synthetic_pool)]
+        self.dataset_size = min(opt.synthetic_samples, opt.max_dataset_size)
+        print('%d synthetic samples of %dx%d' % (len(self.samples), w, h))
+
+        self.initialize_samples(opt)
+
+    def class_probabilities(self):
+        weights = np.arange(1, self.opt.label_nc + 1, dtype=np.float64) ** -self.opt.class_power
+        return weights / weights.sum()
+
+    def draw_sample(self, rng, h, w):
+        opt = self.opt
+        classes = rng.choice(opt.label_nc, size=opt.max_instances + 1, p=self.class_probabilities())
+        label = np.full((h, w), classes[0], dtype=np.uint8)
+        num_instances = rng.integers(opt.min_instances, opt.max_instances + 1)
+        instance = np.zeros((h, w), dtype=np.uint8 if num_instances < 256 else np.int32)
+        yy, xx = np.ogrid[:h, :w]
+        for k in range(1, num_instances + 1):
+            cy, cx = rng.uniform(0, h), rng.uniform(0, w)
+            ry, rx = rng.uniform(h / 16, h / 4), rng.uniform(w / 16, w / 4)
+            mask = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 <= 1
+            label[mask] = classes[k]
+            instance[mask] = k
+
+        # the boundaries of the instances
+        edges = np.zeros((h, w), dtype=bool)
+        edges[:, 1:] |= instance[:, 1:] != instance[:, :-1]
+        edges[1:, :] |= instance[1:, :] != instance[:-1, :]
+
+        palette = rng.integers(0, 256, size=(opt.label_nc, 3))
+        image = palette[label] + rng.normal(0, 16, size=(h, w, 3))
+        return {'label': label,
+                'image': np.clip(image, 0, 255).astype(np.uint8),
+                'instance': instance,
+                'sketch': edges.astype(np.uint8) * 255,
+                }
+
+    def manifest_options(self, opt):
+        options = Pix2pixDataset.manifest_options(self, opt)
+        names = ['synthetic_samples', 'synthetic_pool', 'synthetic_height', 'synthetic_width', 'min_instances',
+                 'max_instances', 'class_power', 'synthetic_seed', 'label_nc', 'crop_size', 'aspect_ratio']
+        options.update({name: getattr(opt, name) for name in names})
+        return options
+
+    def index_sources(self):
+        return []
+
+    def sample_keys(self):
+        return ['synthetic_%06d' % i for i in range(self.dataset_size)]
+
+    def read_files(self, index):
+        sample = dict(self.samples[index % len(self.samples)])
+        if not self.has_images:
+            sample['image'] = None
+        if self.opt.no_instance:
+            sample['instance'] = None
+        if not self.opt.add_sketch:
+            sample['sketch'] = None
+        sample['path'] = 'synthetic_%06d.png' % index
+        return sample
@@ -0,0 +1,99 @@
+import itertools
+import random
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from data import find_dataset_using_name
+from data.pix2pix_dataset import Pix2pixDataset
+from data.tarshards import load_shard_list, read_shard, shard_root
+
+
+class TarShardDataset(Pix2pixDataset, IterableDataset):
+    """ Streams the samples of another dataset_mode from the tar shards written by make_shards.py,
+        for datasets of many small files on network storage. Use --shard_source to name the
+        original dataset_mode and --shard_dir for the directory holding the shards.
+        The shards are split between the ranks and the DataLoader workers. When training, each
+        worker reads its shards in a random order and shuffles the samples in a buffer of
+        --shuffle_buffer samples.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        parser.add_argument('--shard_source', type=str, default='ade20k',
+                            help='dataset_mode the tar shards were written from')
+        parser.add_argument('--shard_dir', type=str, default='',
+                            help='directory of the tar shards, [dataroot]/shards if empty')
+        parser.add_argument('--shuffle_buffer', type=int, default=1000,
+                            help='# samples shuffled together when streaming the shards')
+        opt, _ = parser.parse_known_args()
+        source_class = find_dataset_using_name(opt.shard_source)
+        parser = source_class.modify_commandline_options(parser, is_train)
+        return parser
+
+    # these need random access to the samples
+    unsupported_options = ('preload', 'resize_cache', 'fg_crop_prob')
+
+    def initialize(self, opt):
+        self.initialize_options(opt)
+        self.source_class = find_dataset_using_name(opt.shard_source)
+        self.has_images = self.source_class.has_images and not opt.layout_only
+
+        self.shards = load_shard_list(shard_root(opt))
+        num_samples = sum(n for _, n in self.shards)
+        self.dataset_size = min(num_samples, opt.max_dataset_size)
+        self.limit = opt.max_dataset_size if opt.max_dataset_size < num_samples else None
+        self.shuffle = opt.isTrain and not opt.serial_batches
+
+        self.initialize_samples(opt)
+
+    # the shards read by this rank and DataLoader worker
+    def split_shards(self):
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        shards = [path for path, _ in self.shards]
+        shards = shards[rank * num_workers + worker_id::world_size * num_workers]
+        if self.shuffle:
+            random.shuffle(shards)
+        return shards
+
+    def stream_samples(self):
+        for path in self.split_shards():
+            yield from read_shard(path)
+
+    def shuffled_samples(self):
+        buffer = []
+        for sample in self.stream_samples():
+            if len(buffer) < self.opt.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = random.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        random.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        samples = self.shuffled_samples() if self.shuffle else self.stream_samples()
+        if self.limit is not None:
+            # max_dataset_size, split between the ranks and workers
+            worker = get_worker_info()
+            num_readers = worker.num_workers if worker is not None else 1
+            if dist.is_available() and dist.is_initialized():
+                num_readers *= dist.get_world_size()
+            samples = itertools.islice(samples, -(-self.limit // num_readers))
+        for sample in samples:
+            if not self.has_images:
+                sample['image'] = None
+            yield self.process_sample(sample)
+
+    def __getitem__(self, index):
+        raise TypeError('%s can only be iterated' % type(self).__name__)
+
+    # the samples are transformed exactly like in the source dataset
+    def process_sample(self, sample):
+        return self.source_class.process_sample(self, sample)
+
+    def postprocess(self, input_dict):
+        return self.source_class.postprocess(self, input_dict)
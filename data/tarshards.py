@@ -0,0 +1,109 @@
+"""
+Tar shards of a Pix2pixDataset, read sequentially by --dataset_mode tarshard.
+The files of a sample are stored one after the other, unchanged, as
+    <key>.<plane>.<ext>     plane in label, image, instance, sketch
+    <key>.path.txt          the 'path' entry of the sample
+so that a shard can be streamed from network storage without seeking.
+
+Layout of a sharded split directory:
+    shard_00000.tar, shard_00001.tar, ...
+    shards.json             names and sample counts of the shards
+"""
+
+import io
+import json
+import os
+import tarfile
+import time
+from PIL import Image
+from data.packing import PLANES
+
+
+def shard_root(opt):
+    shard_dir = opt.shard_dir if opt.shard_dir else os.path.join(opt.dataroot, 'shards')
+    return os.path.join(shard_dir, opt.phase)
+
+
+def load_shard_list(root):
+    list_path = os.path.join(root, 'shards.json')
+    assert os.path.isfile(list_path), \
+        '%s is not a sharded dataset, please run make_shards.py first' % root
+    with open(list_path) as f:
+        shards = json.load(f)['shards']
+    return [(os.path.join(root, shard['name']), shard['num_samples']) for shard in shards]
+
+
+class ShardWriter():
+    def __init__(self, root, samples_per_shard=1000):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.samples_per_shard = samples_per_shard
+        self.shards = []
+        self.tar = None
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        name = 'shard_%05d.tar' % len(self.shards)
+        self.tar = tarfile.open(os.path.join(self.root, name), 'w')
+        self.shards.append({'name': name, 'num_samples': 0})
+
+    def _add_bytes(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.tar.addfile(info, io.BytesIO(data))
+
+    # files maps the planes of a sample to their files
+    def add(self, key, files, path):
+        if self.tar is None or self.shards[-1]['num_samples'] >= self.samples_per_shard:
+            self._next_shard()
+        for name, file_path in files.items():
+            ext = os.path.splitext(file_path)[1].lower()
+            with open(file_path, 'rb') as f:
+                self._add_bytes('%s.%s%s' % (key, name, ext), f.read())
+        self._add_bytes('%s.path.txt' % key, str(path).encode())
+        self.shards[-1]['num_samples'] += 1
+
+    def close(self, **meta):
+        if self.tar is not None:
+            self.tar.close()
+        meta.update({'shards': self.shards,
+                     'num_samples': sum(shard['num_samples'] for shard in self.shards)})
+        with open(os.path.join(self.root, 'shards.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        print('wrote %d samples into %d shards at %s' %
+              (meta['num_samples'], len(self.shards), self.root))
+
+
+def decode_sample(files):
+    sample = {name: None for name in PLANES}
+    for name in PLANES:
+        if name in files:
+            plane = Image.open(io.BytesIO(files[name]))
+            sample[name] = plane.convert('RGB') if name == 'image' else plane
+    sample['path'] = files['path'].decode()
+    return sample
+
+
+# Yields the samples of a shard in order, reading it as a stream
+def read_shard(path):
+    key = None
+    files = {}
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            parts = member.name.rsplit('.', 2)
+            if len(parts) != 3 or parts[1] not in PLANES + ('path',):
+                raise ValueError('member %s of the shard %s is not named <key>.<plane>.<ext> with plane in %s' %
+                                 (member.name, path, ', '.join(PLANES + ('path',))))
+            member_key, name, _ = parts
+            if member_key != key:
+                if key is not None:
+                    yield decode_sample(files)
+                key = member_key
+                files = {}
+            files[name] = tar.extractfile(member).read()
+    if key is not None:
+        yield decode_sample(files)
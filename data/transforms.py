@@ -3,7 +3,6 @@
 Transforms and data augmentation for both image + bbox.
 """
 import random
-import torchvision
 import PIL
 import torch
 import torchvision.transforms as T
@@ -71,6 +70,22 @@ def hflip(image, target):
     return flipped_image, target
 
 
+def nearest_index(in_size, out_size):
+    # same source pixels as interpolate(mode='nearest')
+    scale = torch.tensor(in_size / out_size, dtype=torch.float32)
+    index = (torch.arange(out_size, dtype=torch.float32) * scale).floor().long()
+    return index.clamp_(max=in_size - 1)
+
+
+def resize_masks(masks, size):
+    # nearest resize of [N, H, W] masks as a gather of rows and columns,
+    # which keeps their dtype (uint8 or bool)
+    h, w = masks.shape[-2:]
+    rows = nearest_index(h, size[0])
+    cols = nearest_index(w, size[1])
+    return masks[:, rows[:, None], cols[None, :]]
+
+
 def resize(image, target, size, max_size=None):
     # size can be min_size (scalar) or (w, h) tuple
 
@@ -124,8 +139,7 @@ def resize(image, target, size, max_size=None):
     target["size"] = torch.tensor([h, w])
 
     if "masks" in target:
-        target['masks'] = torchvision.ops.misc.interpolate(
-            target['masks'][:, None].float(), size, mode="nearest")[:, 0] > 0.5
+        target['masks'] = resize_masks(target['masks'], size)
 
     return rescaled_image, target
 
@@ -46,4 +46,89 @@ def box_to_square(box, max_size, padding=2, min_size=0):
         y0 -= padding
         y1 += padding
         y0, y1 = clamp_coords(y0, y1, max_size=max_size)
-    return torch.stack([x0, y0, x1, y1])
\ No newline at end of file
+    return torch.stack([x0, y0, x1, y1])
+
+def clamp_coords_(c0, c1, max_size):
+    # clamp_coords of tensors of coordinates, in place
+    shift = torch.where(c0 < 0, -c0, torch.where(c1 > max_size, max_size - c1, torch.zeros_like(c0)))
+    c0 += shift
+    c1 += shift
+
+def boxes_to_squares(boxes, max_w, max_h=None, padding=2):
+    '''
+    box_to_square of all the [N, 4] (x0, y0, x1, y1) pixel boxes at once.
+    max_w and max_h are the image size, scalars or one per box.
+    '''
+    if max_h is None:
+        max_h = max_w
+    boxes = boxes.long().clone()
+    max_w = torch.as_tensor(max_w, dtype=torch.long)
+    max_h = torch.as_tensor(max_h, dtype=torch.long)
+    x0, y0, x1, y1 = boxes.unbind(-1)
+    w = x1 - x0
+    h = y1 - y0
+    # the short side is padded to the long one, the internal padding
+    # going to its start rounded down and to its end rounded up
+    diff = (w - h).abs()
+    lo = diff // 2 + padding
+    hi = diff - diff // 2 + padding
+    wide = w > h
+    tall = h > w
+    zero = torch.zeros_like(w)
+    y0 -= torch.where(wide, lo, torch.where(tall, zero + padding, zero))
+    y1 += torch.where(wide, hi, torch.where(tall, zero + padding, zero))
+    x0 -= torch.where(tall, lo, torch.where(wide, zero + padding, zero))
+    x1 += torch.where(tall, hi, torch.where(wide, zero + padding, zero))
+    clamp_coords_(y0, y1, max_h)
+    clamp_coords_(x0, x1, max_w)
+    return boxes
+
+
+def _pad_to(size, size_divisible):
+    return [(s + size_divisible - 1) // size_divisible * size_divisible for s in size]
+
+def collate_detection(batch, size_divisible=1):
+    '''
+    Collate of (image, target) pairs of the detection datasets (see data/galaxy.py).
+    The images are padded at the bottom right to the largest size of the batch
+    (rounded up to size_divisible) and image_mask is True on their pixels. The
+    per object fields of the targets (boxes, labels, area, iscrowd, masks) are
+    padded to the largest number of objects and object_mask is True on the
+    objects. The other tensor fields are stacked, and the rest are listed.
+    Use it as collate_fn=collate_detection, or through functools.partial.
+    '''
+    images = [image for image, _ in batch]
+    targets = [target for _, target in batch]
+    b = len(batch)
+    h, w = _pad_to([max(image.shape[-2] for image in images), max(image.shape[-1] for image in images)], size_divisible)
+
+    padded = images[0].new_zeros((b, images[0].shape[0], h, w))
+    image_mask = torch.zeros((b, h, w), dtype=torch.bool)
+    for i, image in enumerate(images):
+        ih, iw = image.shape[-2:]
+        padded[i, :, :ih, :iw] = image
+        image_mask[i, :ih, :iw] = True
+
+    counts = [len(target['labels']) for target in targets]
+    n = max(counts + [0])
+    object_mask = torch.zeros((b, n), dtype=torch.bool)
+    for i, count in enumerate(counts):
+        object_mask[i, :count] = True
+
+    collated = {'object_mask': object_mask}
+    for key in targets[0]:
+        values = [target[key] for target in targets]
+        if key in ('boxes', 'labels', 'area', 'iscrowd'):
+            out = values[0].new_zeros((b, n) + values[0].shape[1:])
+            for i, value in enumerate(values):
+                out[i, :len(value)] = value
+        elif key == 'masks':
+            out = values[0].new_zeros((b, n, h, w))
+            for i, value in enumerate(values):
+                out[i, :len(value), :value.shape[-2], :value.shape[-1]] = value
+        elif torch.is_tensor(values[0]):
+            out = torch.stack(values)
+        else:
+            out = values
+        collated[key] = out
+    return padded, image_mask, collated
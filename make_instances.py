@@ -1,33 +1,40 @@
 import os.path
+from functools import partial
+from multiprocessing import Pool
 from PIL import Image
 import numpy as np
-import torch
-import matplotlib.pyplot as plt
 from tqdm import tqdm
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from util.util import reid_instance
 
 parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
 parser.add_argument('--path', type=str, help='Path to datasets')
 parser.add_argument('--dataset', type=str, default='ade20k', help='which dataset to process')
+parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='# processes converting the files')
+parser.add_argument('--connectivity', type=int, default=2, choices=(1, 2), help='radiogalaxy and mask: pixels touching by a side (1) or also by a corner (2) belong to the same source')
+parser.add_argument('--min_area', type=int, default=0, help='radiogalaxy and mask: sources of fewer pixels are left out of the instance maps')
 
 def mkdir_path(path):
     if not os.path.exists(path):
         os.mkdir(path)
-def reid_instance1(inst_tensor):
-    inst_tensor = inst_tensor.float()
-    ori_idx = torch.sort(torch.unique(inst_tensor))[0]
-    new_idx = torch.arange(0, ori_idx.size()[0]).float()
-    out_inst_tensor = torch.zeros_like(inst_tensor)
-    for idx in range(ori_idx.size()[0]):
-        tmp = inst_tensor.clone()
-        tmp[tmp != ori_idx[idx]] = -1
-        tmp[tmp == ori_idx[idx]] = new_idx[idx]
-        tmp[tmp == -1] = 0
-        out_inst_tensor += tmp
-    return out_inst_tensor
+
+# runs function on every job (the paths of one file), in num_workers processes
+def process_files(function, jobs, num_workers):
+    if num_workers > 1:
+        with Pool(num_workers) as pool:
+            return list(tqdm(pool.imap(function, jobs, chunksize=16), total=len(jobs)))
+    return [function(job) for job in tqdm(jobs)]
+
+# saves the map at src_path with its ids renumbered at dst_path,
+# returns the number of ids
+def reid_file(job):
+    src_path, dst_path = job
+    inst = reid_instance(np.array(Image.open(src_path)))
+    Image.fromarray(np.uint8(inst)).save(dst_path)
+    return int(inst.max()) + 1
 
 # process for ade20k dataset
-def make_inst_for_ade20k(path):
+def make_inst_for_ade20k(path, num_workers=1):
     def make_inst_subset(path, set='validation'):
         assert set == 'validation' or set == 'training', "set is validation or training"
         print('process ', set)
@@ -38,18 +45,13 @@ def make_inst_for_ade20k(path):
         tag_ins_root = os.path.join(tag_root,set)
         mkdir_path(tag_ins_root)
         names = sorted(os.listdir(src_root))
-        for id in tqdm(range(len(names))):
-            name = names[id]
-            src_mask = np.array(Image.open(os.path.join(src_root,name)))
-            tag_label_tensor = torch.from_numpy(src_mask)
-            tag_inst = reid_instance1(tag_label_tensor).numpy()
-            tag_inst = Image.fromarray(np.uint8(tag_inst))
-            tag_inst.save(os.path.join(tag_ins_root,name))
+        jobs = [(os.path.join(src_root, name), os.path.join(tag_ins_root, name)) for name in names]
+        process_files(reid_file, jobs, num_workers)
     make_inst_subset(path, 'validation')
     make_inst_subset(path, 'training')
 
 # process for celeba-mask dataset
-def make_inst_for_celeba(path):
+def make_inst_for_celeba(path, num_workers=1):
     def make_inst_subset(path, set='test'):
         assert set == 'test' or set == 'train', "set is test or train"
         print('process ', set)
@@ -57,18 +59,21 @@ def make_inst_for_celeba(path):
         tag_root = os.path.join(path,set,'instances')
         mkdir_path(tag_root)
         names = sorted(os.listdir(src_root))
-        for id in tqdm(range(len(names))):
-            name = names[id]
-            src_mask = np.array(Image.open(os.path.join(src_root,name)))
-            tag_label_tensor = torch.from_numpy(src_mask)
-            tag_inst = reid_instance1(tag_label_tensor).numpy()
-            tag_inst = Image.fromarray(np.uint8(tag_inst))
-            tag_inst.save(os.path.join(tag_root,name))
+        jobs = [(os.path.join(src_root, name), os.path.join(tag_root, name)) for name in names]
+        process_files(reid_file, jobs, num_workers)
     make_inst_subset(path, 'test')
     make_inst_subset(path, 'train')
 
+# saves the first channel of the mask at src_path as the label map at
+# lab_path, and its ids renumbered as the instance map at ins_path
+def split_deepfashion_file(job):
+    src_path, lab_path, ins_path = job
+    tag_label = np.array(Image.open(src_path))[:, :, 0]
+    Image.fromarray(np.uint8(tag_label)).save(lab_path)
+    Image.fromarray(np.uint8(reid_instance(tag_label))).save(ins_path)
+
 # process for deepfashion dataset
-def make_inst_for_deepfashion(path):
+def make_inst_for_deepfashion(path, num_workers=1):
     def make_inst_subset(path, set='test'):
         assert set == 'test' or set == 'train', "set is test or train"
         print('process ', set)
@@ -78,38 +83,14 @@ def make_inst_for_deepfashion(path):
         mkdir_path(tag_lab_root)
         mkdir_path(tag_ins_root)
         names = sorted(os.listdir(src_root))
-        for id in tqdm(range(len(names))):
-            name = names[id]
-            src_mask = np.array(Image.open(os.path.join(src_root,name)))
-            tag_label = src_mask[:,:,0]
-            tag_label_tensor = torch.from_numpy(tag_label)
-            tag_inst = reid_instance1(tag_label_tensor).numpy()
-            tag_label = Image.fromarray(np.uint8(tag_label))
-            tag_inst = Image.fromarray(np.uint8(tag_inst))
-            tag_label.save(os.path.join(tag_lab_root,name))
-            tag_inst.save(os.path.join(tag_ins_root,name))
+        jobs = [(os.path.join(src_root, name), os.path.join(tag_lab_root, name), os.path.join(tag_ins_root, name))
+                for name in names]
+        process_files(split_deepfashion_file, jobs, num_workers)
     make_inst_subset(path, 'test')
     make_inst_subset(path, 'train')
 
 # process for cityscapes dataset
-def reid_instance(inst_tensor):
-    inst_tensor = inst_tensor.float()
-    ori_idx = torch.unique(inst_tensor)
-    new_idx = torch.arange(0,ori_idx.size()[0]).float()
-    out_inst_tensor = torch.zeros_like(inst_tensor)
-    for idx in range(ori_idx.size()[0]):
-        tmp = inst_tensor.clone()
-        tmp[tmp!=ori_idx[idx]] = -1
-        tmp[tmp==ori_idx[idx]] = new_idx[idx]
-        tmp[tmp==-1] = 0
-        out_inst_tensor += tmp
-    return out_inst_tensor
-
-def make_dir(path):
-    if not os.path.exists(path):
-        os.mkdir(path)
-
-def reid_cityscapes_dataset(dir='/home/tzt/dataset/cityscapes/'):
+def reid_cityscapes_dataset(dir='/home/tzt/dataset/cityscapes/', num_workers=1):
     label_dir = os.path.join(dir, 'gtFine')
     phases = ['val', 'train']
     count = 0
@@ -117,26 +98,51 @@ def reid_cityscapes_dataset(dir='/home/tzt/dataset/cityscapes/'):
         if 'test' in phase:
             continue
         print('process', phase, 'dataset')
+        jobs = []
         citys = sorted(os.listdir(os.path.join(label_dir, phase)))
         for city in citys:
             label_path = os.path.join(label_dir, phase, city)
             label_names_all = sorted(os.listdir(label_path))
             instance_names = [p for p in label_names_all if p.endswith('_instanceIds.png')]
             for instance_name in instance_names:
-                # print(instance_name)
-                inst_np = np.array(Image.open(os.path.join(label_path, instance_name)))
-                inst_tensor = torch.from_numpy(inst_np)
-                reid_inst_tensor = reid_instance(inst_tensor)
-                reid_inst_np = reid_inst_tensor.numpy()
-                # print('-------------------')
-                # print(np.unique(inst_np))
-                # print(np.unique(reid_inst_np))
                 save_name = instance_name[:-7]+'ReIds.png'
-                reid_inst_save = Image.fromarray(np.uint8(reid_inst_np))
-                reid_inst_save.save(os.path.join(label_path,save_name))
-                id_num = len(np.unique(reid_inst_np))
-                count += (1 if id_num > 255 else 0)
-                print('process',instance_name,'with',id_num,'numbers')
+                jobs.append((os.path.join(label_path, instance_name), os.path.join(label_path, save_name)))
+        id_nums = process_files(reid_file, jobs, num_workers)
+        count += sum(1 for id_num in id_nums if id_num > 255)
+    print('Finished! The number of map which more than 255 id is',count)
+
+# saves the connected components of every class of the label map at
+# src_path as the instance map at dst_path, returns the number of ids
+def components_file(job, connectivity=2, min_area=0):
+    from skimage.measure import label as connected_components
+    src_path, dst_path = job
+    mask = np.array(Image.open(src_path))
+    # the regions of equal values are labelled all at once, 0 and 255 (unknown) are no source
+    inst = connected_components(np.where(mask == 255, 0, mask), background=0, connectivity=connectivity)
+    if min_area > 1:
+        small = np.bincount(inst.reshape(-1)) < min_area
+        small[0] = False
+        inst[small[inst]] = 0
+    inst = reid_instance(inst)
+    Image.fromarray(np.uint8(inst)).save(dst_path)
+    return int(inst.max()) + 1
+
+# process for radiogalaxy and mask datasets: the label maps are in
+# [phase]/masks and the instance maps are written to [phase]/instances
+def make_inst_for_components(path, num_workers=1, connectivity=2, min_area=0):
+    count = 0
+    for phase in sorted(os.listdir(path)):
+        src_root = os.path.join(path, phase, 'masks')
+        if not os.path.isdir(src_root):
+            continue
+        print('process', phase)
+        tag_root = os.path.join(path, phase, 'instances')
+        mkdir_path(tag_root)
+        names = sorted(name for name in os.listdir(src_root) if name.endswith('.png'))
+        jobs = [(os.path.join(src_root, name), os.path.join(tag_root, name)) for name in names]
+        id_nums = process_files(partial(components_file, connectivity=connectivity, min_area=min_area),
+                                jobs, num_workers)
+        count += sum(1 for id_num in id_nums if id_num > 255)
     print('Finished! The number of map which more than 255 id is',count)
 
 if __name__ == '__main__':
@@ -144,12 +150,14 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
     if args.dataset == 'ade20k':
-        make_inst_for_ade20k(args.path)
+        make_inst_for_ade20k(args.path, args.num_workers)
     elif args.dataset == 'cityscapes':
-        reid_cityscapes_dataset(args.path)
+        reid_cityscapes_dataset(args.path, args.num_workers)
     elif args.dataset == 'deepfashion':
-        make_inst_for_deepfashion(args.path)
+        make_inst_for_deepfashion(args.path, args.num_workers)
     elif args.dataset == 'celeba':
-        make_inst_for_celeba(args.path)
+        make_inst_for_celeba(args.path, args.num_workers)
+    elif args.dataset in ['radiogalaxy', 'mask']:
+        make_inst_for_components(args.path, args.num_workers, args.connectivity, args.min_area)
     else:
-        print('Error! dataset must be one of [ade20k|cityscapes|deepfashion|celeba]')
+        print('Error! dataset must be one of [ade20k|cityscapes|deepfashion|celeba|radiogalaxy|mask]')
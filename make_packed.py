@@ -0,0 +1,29 @@
+from tqdm import tqdm
+import data
+from data.packing import PackedWriter, packed_root
+from options.test_options import TestOptions
+
+# Packs the label/image/instance/sketch maps of a dataset into the shards read by
+# --dataset_mode packed, e.g.
+# python make_packed.py --dataset_mode ade20k --dataroot [Path_to_dataset] --phase train
+
+
+class PackOptions(TestOptions):
+    def initialize(self, parser):
+        TestOptions.initialize(self, parser)
+        parser.add_argument('--packed_dir', type=str, default='', help='where to write the shards, [dataroot]/packed if empty')
+        parser.add_argument('--shard_size', type=int, default=1024, help='size of each shard file in MB')
+        parser.set_defaults(gpu_ids='-1')
+        return parser
+
+
+if __name__ == '__main__':
+    opt = PackOptions().parse()
+
+    dataset = data.find_dataset_using_name(opt.dataset_mode)()
+    dataset.initialize(opt)
+
+    writer = PackedWriter(packed_root(opt), opt.shard_size << 20)
+    for index in tqdm(range(len(dataset))):
+        writer.add(dataset.load_sample(index))
+    writer.close(source=opt.dataset_mode)
@@ -0,0 +1,44 @@
+import random
+from tqdm import tqdm
+import data
+from data.tarshards import ShardWriter, shard_root
+from options.test_options import TestOptions
+
+# Writes the files of a dataset into the tar shards streamed by
+# --dataset_mode tarshard, e.g.
+# python make_shards.py --dataset_mode ade20k --dataroot [Path_to_dataset] --phase train
+
+
+class ShardOptions(TestOptions):
+    def initialize(self, parser):
+        TestOptions.initialize(self, parser)
+        parser.add_argument('--shard_dir', type=str, default='', help='where to write the shards, [dataroot]/shards if empty')
+        parser.add_argument('--samples_per_shard', type=int, default=1000, help='# samples in each shard')
+        parser.add_argument('--keep_order', action='store_true', help='if specified, write the samples in the order of the dataset instead of shuffling them. The reader only shuffles within a bounded buffer, so in-order shards give less random batches')
+        parser.set_defaults(gpu_ids='-1')
+        return parser
+
+
+if __name__ == '__main__':
+    opt = ShardOptions().parse()
+
+    dataset = data.find_dataset_using_name(opt.dataset_mode)()
+    dataset.initialize(opt)
+
+    order = list(range(len(dataset)))
+    if not opt.keep_order:
+        random.Random(0).shuffle(order)
+
+    writer = ShardWriter(shard_root(opt), opt.samples_per_shard)
+    for index in tqdm(order):
+        label_path = dataset.label_paths[index]
+        files = {'label': label_path}
+        if dataset.has_images:
+            files['image'] = dataset.image_paths[index]
+        if not opt.no_instance:
+            files['instance'] = dataset.instance_paths[index]
+        if opt.add_sketch:
+            files['sketch'] = dataset.sketch_paths[index]
+        path = files['image'] if dataset.has_images else label_path
+        writer.add(dataset.pairing_key(label_path), files, path)
+    writer.close(source=opt.dataset_mode)
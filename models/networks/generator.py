@@ -64,11 +64,23 @@ class SPADEGenerator(BaseNetwork):
             raise ValueError('opt.num_upsampling_layers [%s] not recognized' %
                              opt.num_upsampling_layers)
 
+        self.num_up_layers = num_up_layers
         sw = opt.crop_size // (2**num_up_layers)
         sh = round(sw / opt.aspect_ratio)
 
         return sw, sh
 
+    # the latent map of a batch, the size of crop_size / aspect_ratio
+    # except for the batches of --batch_sampler size_bucket
+    def latent_size(self, seg):
+        h, w = seg.size()[2:]
+        return max(h >> self.num_up_layers, 1), max(w >> self.num_up_layers, 1)
+
+    def resize_latent(self, x, size):
+        if x.size()[2:] == size:
+            return x
+        return F.interpolate(x, size=size, mode='bilinear', align_corners=False)
+
     def pre_process_noise(self, noise, z):
         '''
         noise: [n,inst_nc,2,noise_nc], z_i [n,inst_nc,noise_nc]
@@ -80,6 +92,7 @@ class SPADEGenerator(BaseNetwork):
 
     def forward(self, input, z=None, input_instances=None, sketch=None, noise=None, noise_ins=None):
         seg = input
+        sh, sw = self.latent_size(seg)
 
         # Part 1. Process the input
         if self.opt.use_vae and 'spade' in self.opt.norm_mode:
@@ -89,6 +102,7 @@ class SPADEGenerator(BaseNetwork):
                                 dtype=torch.float32, device=input.get_device())
             x = self.fc(z)
             x = x.view(-1, 16 * self.opt.ngf, self.sh, self.sw)
+            x = self.resize_latent(x, (sh, sw))
         elif 'inade' in self.opt.norm_mode:
             # INADE feeds the random noise as the input of generator
             if noise_ins is None:
@@ -96,9 +110,10 @@ class SPADEGenerator(BaseNetwork):
                                     dtype=torch.float32, device=input.get_device())
             x = self.fc(noise_ins)
             x = x.view(-1, 16 * self.opt.ngf, self.sh, self.sw)
+            x = self.resize_latent(x, (sh, sw))
         else:
             # we downsample segmap and run convolution
-            x = F.interpolate(seg, size=(self.sh, self.sw))
+            x = F.interpolate(seg, size=(sh, sw))
             x = self.fc(x)
 
         # Part 2. Process the noise for INADE if necessary
@@ -48,7 +48,11 @@ class Pix2PixModel(torch.nn.Module):
     # can't parallelize custom functions, we branch to different
     # routines based on |mode|.
     def forward(self, data, mode, noise=None, noise_ins=None):
-        input_semantics, real_image, input_instances, sketch = self.preprocess_input(data)
+        # the inputs may have been computed in advance by data/prefetcher.py
+        if 'inputs' in data:
+            input_semantics, real_image, input_instances, sketch = data['inputs']
+        else:
+            input_semantics, real_image, input_instances, sketch = self.preprocess_input(data)
 
         if mode == 'generator':
             g_loss, generated = self.compute_generator_loss(
@@ -129,14 +133,24 @@ class Pix2PixModel(torch.nn.Module):
     # |data|: dictionary of the input data
 
     def preprocess_input(self, data):
+        # the batch is used again by the next step, it is not modified
+        data = dict(data)
         # move to GPU and change data types
-        data['label'] = data['label'].long()
         if self.use_gpu():
             data['label'] = data['label'].cuda()
             data['instance'] = data['instance'].cuda()
-            data['image'] = data['image'].cuda()
+            if 'image' in data:
+                data['image'] = data['image'].cuda()
             data['sketch'] = data['sketch'].cuda()
 
+        data['label'] = data['label'].long()
+
+        # with --uint8_pipeline the images and sketches arrive as uint8
+        if 'image' in data and data['image'].dtype == torch.uint8:
+            data['image'] = data['image'].float().div_(127.5).sub_(1.0)
+        if data['sketch'].dtype == torch.uint8:
+            data['sketch'] = data['sketch'].float().div_(255.0)
+
         # create one-hot label map
         label_map = data['label']
         bs, _, h, w = label_map.size()
@@ -161,7 +175,8 @@ class Pix2PixModel(torch.nn.Module):
         else:
             input_instances = None
 
-        return input_semantics, data['image'], input_instances, data['sketch']
+        # no image with --layout_only
+        return input_semantics, data.get('image'), input_instances, data['sketch']
 
     def compute_generator_loss(self, input_semantics, real_image, input_instances, sketch):
         G_losses = {}
@@ -240,7 +255,11 @@ class Pix2PixModel(torch.nn.Module):
     def generate_fake(self, input_semantics, real_image, input_instances, sketch, compute_kld_loss=False):
         z = None
         KLD_loss = None
-        if self.opt.use_vae:
+        if self.opt.use_vae and real_image is None:
+            # no image to encode (--layout_only), z is drawn from the prior
+            if 'inade' in self.opt.norm_mode:
+                z = self.prior_z(input_instances)
+        elif self.opt.use_vae:
             if 'spade' in self.opt.norm_mode:
                 z, mu, logvar = self.encode_z(real_image)
                 if compute_kld_loss:
@@ -261,6 +280,14 @@ class Pix2PixModel(torch.nn.Module):
 
         return fake_image, KLD_loss
 
+    # zero means and unit stds for every instance, see pre_process_noise in
+    # models/networks/generator.py
+    def prior_z(self, input_instances):
+        bs, inst_nc = input_instances.shape[:2]
+        mus = torch.zeros([bs, inst_nc, self.opt.noise_nc], device=input_instances.device)
+        stds = torch.ones([bs, inst_nc, self.opt.noise_nc], device=input_instances.device)
+        return [mus, stds, mus, stds]
+
     # Given fake and real image, return the prediction of discriminator
     # for each fake and real image.
 
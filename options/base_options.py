@@ -45,11 +45,26 @@ class BaseOptions():
         parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
         parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data argumentation')
         parser.add_argument('--nThreads', default=0, type=int, help='# threads for loading data')
+        parser.add_argument('--sampler', type=str, default='random', choices=('random', 'class_balanced', 'resumable'), help='how the training samples are drawn. class_balanced: samples containing rare classes are drawn more often. resumable: the order of every epoch is drawn from --sampler_seed, so that --continue_train resumes an interrupted epoch where it stopped')
+        parser.add_argument('--sampler_seed', type=int, default=0, help='seed of the order of the samples with --sampler resumable')
+        parser.add_argument('--class_balance_power', type=float, default=0.5, help='with --sampler class_balanced, a class present in a fraction f of the samples has the weight f^-power. 0 is uniform sampling')
+        parser.add_argument('--batch_sampler', type=str, default='none', choices=('none', 'instance_bucket', 'size_bucket'), help='how the training samples are grouped into batches. instance_bucket: batches of samples with similar numbers of instances, which keeps the one-hot instance maps small. size_bucket: with --preprocess_mode none, batches of samples of the same size, also used for testing')
+        parser.add_argument('--bucket_batches', type=int, default=50, help='with --batch_sampler instance_bucket, the samples are sorted by instance count in groups of this many batches')
+        parser.add_argument('--bucket_step', type=int, default=64, help='with --batch_sampler size_bucket, the samples are resized to their size rounded to a multiple of this, and batched with the samples of the same rounded size')
+        parser.add_argument('--pin_memory', action='store_true', help='if specified, the batches are copied to page-locked memory, which makes the copies to the GPU faster')
+        parser.add_argument('--persistent_workers', action='store_true', help='if specified, the loader workers are kept alive between epochs')
+        parser.add_argument('--prefetch_factor', type=int, default=2, help='# batches loaded in advance by every loader worker')
+        parser.add_argument('--device_prefetch', action='store_true', help='if specified, the next batch is copied to the GPU and turned into the network inputs on a side CUDA stream while the current one is used (in a background thread without GPU)')
+        parser.add_argument('--loader_seed', type=int, default=-1, help='seed of the shuffling and of the random augmentations of the loader workers, -1 for a random seed')
+        parser.add_argument('--autotune_loader', action='store_true', help='if specified, measure the loading speed with different numbers of workers and prefetch factors at start, and use the fastest. Replaces --nThreads and --prefetch_factor')
+        parser.add_argument('--autotune_batches', type=int, default=20, help='# batches measured for every setting with --autotune_loader')
         parser.add_argument('--max_dataset_size', type=int, default=sys.maxsize, help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
         parser.add_argument('--load_from_opt_file', action='store_true', help='load the options from checkpoints and use that as default')
         parser.add_argument('--cache_filelist_write', action='store_true', help='saves the current filelist into a text file, so that it loads faster')
         parser.add_argument('--cache_filelist_read', action='store_true', help='reads from the file list cache')
         parser.add_argument('--add_sketch', action='store_true', help='if specified, add sketch map as input')
+        parser.add_argument('--uint8_pipeline', action='store_true', help='if specified, the datasets return uint8 tensors and the conversion to float and the normalization are done on the device')
+        parser.add_argument('--batch_augment', action='store_true', help='if specified, the datasets return full size uint8 maps and the random resize/crop/flip is done on the collated batch on the device. All the images of a dataset must have the same size. Implies --uint8_pipeline')
 
         # for displays
         parser.add_argument('--display_winsize', type=int, default=400, help='display window size')
@@ -159,6 +174,10 @@ class BaseOptions():
         opt = self.gather_options()
         opt.isTrain = self.isTrain   # train or test
 
+        # the batched augmentation works on uint8 inputs
+        if opt.batch_augment:
+            opt.uint8_pipeline = True
+
         self.print_options(opt)
         if opt.isTrain:
             self.save_options(opt)
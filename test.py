@@ -7,23 +7,37 @@ import os
 from collections import OrderedDict
 
 import data
+from data.prefetcher import DevicePrefetcher
 from options.test_options import TestOptions
 from models.pix2pix_model import Pix2PixModel
 from util.visualizer import Visualizer
 from util import html
-from PIL import Image
-import torchvision.transforms.functional as F
+import torch
 
 label_colors = [[0.000, 0.447, 0.741], [0.850, 0.325, 0.098], 
                 [0.929, 0.694, 0.125], [0.494, 0.184, 0.556]]
 
+
+# the image of a batch in [-1, 1]
+def image_visual(image):
+    image = image.detach().cpu()
+    if image.dtype == torch.uint8:
+        return image.float() / 127.5 - 1
+    return image
+
+
 opt = TestOptions().parse()
 
 dataloader = data.create_dataloader(opt)
+# MaskDataset returns a random placeholder image unless using --layout_only
+has_images = dataloader.dataset.has_images
 
 model = Pix2PixModel(opt)
 model.eval()
 
+if opt.device_prefetch:
+    dataloader = DevicePrefetcher(dataloader, model.preprocess_input, use_cuda=len(opt.gpu_ids) > 0)
+
 visualizer = Visualizer(opt)
 
 # create a webpage that summarizes the all results
@@ -44,14 +58,14 @@ for i, data_i in enumerate(dataloader):
     img_path = data_i['path']
     for b in range(generated.shape[0]):
         print('process image... %s' % img_path[b])
-        image = Image.open(img_path[b])
-        im_tensor = F.to_tensor(image) * 2 - 1
-        label_path = img_path[b].replace('images', 'masks')
-        label = Image.open(label_path) 
-        lbl_tensor = F.to_tensor(label) * 2 - 1
-        visuals = OrderedDict([('original_image', im_tensor),
-                               ('input_label', lbl_tensor),
-                               ('synthesized_image', generated[b])])
+        # the visuals are made from the batch instead of reading the files
+        # again, there is no image with --layout_only
+        visuals = OrderedDict()
+        if has_images and 'image' in data_i:
+            visuals['original_image'] = image_visual(data_i['image'][b])
+        # the class ids, colorized by the Visualizer
+        visuals['input_label'] = data_i['label'][b].detach().cpu()
+        visuals['synthesized_image'] = generated[b]
         visualizer.save_images(webpage, visuals, img_path[b:b + 1])
 
 webpage.save()
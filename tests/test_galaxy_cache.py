@@ -0,0 +1,39 @@
+import json
+import numpy as np
+import torch
+from PIL import Image
+from data.galaxy import GalaxyDetection
+
+
+def make_dataset(root):
+    (root / 'images').mkdir()
+    images, annotations = [], []
+    for i in range(3):
+        Image.fromarray(np.zeros((40, 50, 3), dtype=np.uint8)).save(root / 'images' / ('gal_%d.png' % i))
+        images.append({'id': i + 1, 'file_name': 'gal_%d.png' % i, 'width': 50, 'height': 40})
+    # the last image has no source
+    for i, (x, y, s) in enumerate([(5, 4, 10), (20, 10, 12), (30, 20, 8)]):
+        polygon = [x, y, x + s, y, x + s, y + s, x, y + s]
+        annotations.append({'id': i + 1, 'image_id': 1 + i // 2, 'category_id': 1 + i % 4, 'segmentation': [polygon],
+                            'bbox': [x, y, s, s], 'area': float(s * s), 'iscrowd': 0})
+    categories = [{'id': c, 'name': str(c)} for c in range(1, 5)]
+    with open(root / 'ann.json', 'w') as f:
+        json.dump({'images': images, 'annotations': annotations, 'categories': categories}, f)
+    return root / 'images', root / 'ann.json'
+
+
+def test_cached_targets_equal_prepared_targets(tmp_path):
+    img_folder, ann_file = make_dataset(tmp_path)
+    plain = GalaxyDetection(img_folder, ann_file, transforms=None, return_masks=True)
+    cached = GalaxyDetection(img_folder, ann_file, transforms=None, return_masks=True,
+                             cache_file=tmp_path / 'targets.npz')
+    for idx in range(len(plain)):
+        _, expected = plain[idx]
+        _, target = cached[idx]
+        assert expected.keys() == target.keys()
+        for key, value in expected.items():
+            if torch.is_tensor(value):
+                assert target[key].dtype == value.dtype, key
+                assert torch.equal(target[key], value), key
+            else:
+                assert target[key] == value, key
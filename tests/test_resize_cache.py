@@ -0,0 +1,33 @@
+from argparse import Namespace
+import numpy as np
+from PIL import Image
+from data.resize_cache import ResizeCache
+
+
+def make_cache(tmp_path):
+    opt = Namespace(preprocess_mode='resize_and_crop', load_size=286, crop_size=256, aspect_ratio=1.0,
+                    isTrain=True, no_flip=False, index_dir=str(tmp_path), dataroot=str(tmp_path), phase='train')
+    return ResizeCache(opt, {'dataset_mode': 'celebamask'})
+
+
+# CelebAMask-HQ: 1024px JPEG images, 512px label maps
+def test_draft_uses_the_image_size(tmp_path):
+    Image.fromarray(np.zeros((1024, 1024, 3), dtype=np.uint8)).save(tmp_path / 'image.jpg')
+    label = Image.fromarray(np.zeros((512, 512), dtype=np.uint8))
+    cache = make_cache(tmp_path)
+
+    image = Image.open(tmp_path / 'image.jpg')
+    cache.draft(image, label.size)
+    assert image.convert('RGB').size == (512, 512)
+
+    sample = cache.save('key', {'label': label, 'image': image.convert('RGB'), 'instance': None, 'sketch': None})
+    assert sample['image'].shape == (286, 286, 3)
+    assert sample['label'].shape == (286, 286)
+
+
+def test_no_draft_when_the_image_is_small(tmp_path):
+    Image.fromarray(np.zeros((400, 400, 3), dtype=np.uint8)).save(tmp_path / 'image.jpg')
+    cache = make_cache(tmp_path)
+    image = Image.open(tmp_path / 'image.jpg')
+    cache.draft(image, (1024, 1024))
+    assert image.convert('RGB').size == (400, 400)
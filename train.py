@@ -8,6 +8,8 @@ from collections import OrderedDict
 from options.train_options import TrainOptions
 import data
 from data.base_dataset import repair_data
+from data.prefetcher import DevicePrefetcher
+from data.samplers import ResumableSampler
 from util.iter_counter import IterationCounter
 from util.visualizer import Visualizer
 from trainers.pix2pix_trainer import Pix2PixTrainer
@@ -34,6 +36,14 @@ iter_counter = IterationCounter(opt, len(dataloader))
 # create tool for visualization
 visualizer = Visualizer(opt)
 
+# with --sampler resumable, an interrupted epoch is resumed where it stopped
+sampler = dataloader.sampler if isinstance(dataloader.sampler, ResumableSampler) else None
+sampler_state_path = os.path.join(opt.checkpoints_dir, opt.name, 'sampler.json')
+
+if opt.device_prefetch:
+    dataloader = DevicePrefetcher(dataloader, trainer.pix2pix_model_on_one_gpu.preprocess_input,
+                                  use_cuda=len(opt.gpu_ids) > 0)
+
 if opt.train_eval:
     # val_opt = TestOptions().parse()
     original_flip = opt.no_flip
@@ -72,7 +82,12 @@ else:
     FID_score = 1000      
 
 for epoch in iter_counter.training_epochs():
+    resume_iter = iter_counter.epoch_iter if epoch == iter_counter.first_epoch else 0
     iter_counter.record_epoch_start(epoch)
+    if sampler is not None:
+        start = sampler.resume(sampler_state_path, epoch, resume_iter) if resume_iter > 0 else 0
+        sampler.set_epoch(epoch, start)
+        iter_counter.epoch_iter = start
     for i, data_i in enumerate(dataloader, start=iter_counter.epoch_iter):
         iter_counter.record_one_iteration()
 
@@ -107,6 +122,8 @@ for epoch in iter_counter.training_epochs():
                   (epoch, iter_counter.total_steps_so_far))
             trainer.save('latest')
             iter_counter.record_current_iter(FID_score)
+            if sampler is not None:
+                sampler.save_state(sampler_state_path, iter_counter.epoch_iter)
 
     trainer.update_learning_rate(epoch)
     iter_counter.record_epoch_end()
@@ -170,6 +170,14 @@ def natural_sort(items):
     items.sort(key=natural_keys)
 
 
+# The ids of an instance (or label) map renumbered 0, 1, 2, ... in increasing
+# order, in one pass over the pixels
+def reid_instance(instance):
+    instance = np.asarray(instance)
+    _, inverse = np.unique(instance, return_inverse=True)
+    return inverse.reshape(instance.shape)
+
+
 def str2bool(v):
     if v.lower() in ('yes', 'true', 't', 'y', '1'):
         return True
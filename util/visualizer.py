@@ -139,10 +139,10 @@ class Visualizer():
     def convert_visuals_to_numpy(self, visuals):
         for key, t in visuals.items():
             tile = self.opt.batchSize > 8
-            # if 'input_label' == key:
-            #     t = util.tensor2label(t, self.opt.label_nc + 2, tile=tile)
-            # else:
-            t = util.tensor2im(t, tile=tile)
+            if 'input_label' == key:
+                t = util.tensor2label(t, self.opt.label_nc + 2, tile=tile)
+            else:
+                t = util.tensor2im(t, tile=tile)
             visuals[key] = t
         return visuals
 